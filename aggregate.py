@@ -0,0 +1,168 @@
+"""
+Grouped statistics of the citation boost. group_stats computes the number of papers, the
+mean, its standard error and quantiles for any set of keys in a single pass over the
+data, and Aggregates caches them (together with bootstrap confidence intervals of the
+mean) so that every figure can reuse them.
+"""
+
+import numpy as np
+import pandas as pd
+import bootstrap
+from grouping import factorize
+
+QUANTILES = (0.25, 0.5, 0.75)
+
+def group_stats(dat, keys, value = 'citation_boost', quantiles = QUANTILES, order = None):
+    """
+    Statistics of `value` for every group of papers with the same `keys`. The groups are
+    factorized once and everything is computed from the group codes with NumPy.
+
+    Returns a dataframe indexed by the (sorted) keys with columns 'count', 'mean', 'sem'
+    (standard error of the mean) and 'q25', 'q50', ... for the requested quantiles
+    (linear interpolation, same as pandas). `order` are the indices that sort `value`,
+    they do not depend on the keys and can be reused.
+    """
+    codes, index = factorize(dat, keys)
+    values = dat[value].to_numpy(dtype = float)
+    num_groups = len(index)
+    if order is None:
+        order = np.argsort(values)
+
+    # Papers with missing key or value do not count
+    codes = codes.astype(np.int16 if num_groups < 2**15 else np.int64)
+    valid = (codes >= 0) & ~np.isnan(values)
+    if not valid.all():
+        order = order[valid[order]]
+        codes[~valid] = 0 # Only papers in `order` are used below
+        values = np.where(valid, values, 0)
+
+    count = np.bincount(codes, weights = valid, minlength = num_groups).astype(int)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        mean = np.bincount(codes, weights = values, minlength = num_groups)/count
+        squares = np.bincount(codes, weights = valid*(values - mean[codes])**2, minlength = num_groups)
+        sem = np.sqrt(squares/(count - 1)/count)
+
+    stats = pd.DataFrame({'count': count, 'mean': mean, 'sem': sem}, index = index)
+
+    # Sort the values within each group, the quantiles are then read off by position.
+    # A stable sort of the small integer group codes keeps the values sorted in a group.
+    if quantiles:
+        ordered = values[order[np.argsort(codes[order], kind = 'stable')]]
+        start = np.cumsum(count) - count
+        last = np.maximum(count - 1, 0)
+        for q in quantiles:
+            position = q*last
+            below = np.floor(position).astype(int)
+            above = np.minimum(below + 1, last)
+            low = ordered[np.minimum(start + below, len(ordered) - 1)] if len(ordered) else np.zeros(num_groups)
+            high = ordered[np.minimum(start + above, len(ordered) - 1)] if len(ordered) else np.zeros(num_groups)
+            stats[f'q{round(100*q)}'] = np.where(count > 0, low + (position - below)*(high - low), np.nan)
+
+    return stats
+
+class Aggregates:
+    """
+    Cache of group_stats and bootstrap confidence intervals over named subsets of the
+    papers (e.g. 'all', 'recent')
+    """
+    def __init__(self, subsets, value = 'citation_boost', quantiles = QUANTILES):
+        self.subsets = subsets
+        self.value = value
+        self.quantiles = quantiles
+        self.cache = {}
+        self.orders = {}
+        self.intervals = {}
+
+    def stats(self, subset, *keys):
+        """
+        Statistics of the given subset grouped by the given keys, computed on first use
+        """
+        if (subset, keys) not in self.cache:
+            dat = self.subsets[subset]
+            if subset not in self.orders:
+                self.orders[subset] = np.argsort(dat[self.value].to_numpy(dtype = float))
+            self.cache[(subset, keys)] = group_stats(dat, keys, self.value, self.quantiles, self.orders[subset])
+        return self.cache[(subset, keys)]
+
+    def ci(self, subset, *keys):
+        """
+        Bootstrap confidence intervals of the mean of the given subset grouped by the
+        given keys (see bootstrap.py), computed on first use
+        """
+        if (subset, keys) not in self.intervals:
+            self.intervals[(subset, keys)] = bootstrap.group_ci(self.subsets[subset], keys, self.value)
+        return self.intervals[(subset, keys)]
+
+def merge_stats(parts):
+    """
+    Combine the statistics computed by group_stats on disjoint sets of papers into the
+    statistics of all of them. Counts add up and the means and the sums of squared
+    deviations (recovered from the standard errors) are combined as in the parallel
+    algorithm of Chan et al. Quantiles cannot be merged and are dropped.
+    """
+    parts = [part[['count', 'mean', 'sem']] for part in parts if part is not None]
+    if not any(len(part) for part in parts):
+        return parts[-1]
+    frame = pd.concat([part for part in parts if len(part)])
+    count = frame['count']
+    seen = count > 0
+    squares = (frame['sem']**2*count*(count - 1)).where(count > 1, 0)
+    levels = list(range(frame.index.nlevels))
+
+    total = count.groupby(level = levels).sum()
+    mean = (count*frame['mean']).where(seen, 0).groupby(level = levels).sum()/total
+    deviation = (frame['mean'] - mean.reindex(frame.index).to_numpy()).where(seen, 0)
+    squares = (squares + count*deviation**2).groupby(level = levels).sum()
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        sem = np.sqrt(squares/(total - 1)/total)
+    return pd.DataFrame({'count': total, 'mean': mean, 'sem': sem})
+
+class ChunkedAggregates:
+    """
+    Same as Aggregates, but fed one partition of the papers at a time (see add). Only the
+    statistics and confidence intervals listed up front are kept, as running merged
+    statistics and Poisson bootstrap sums (see bootstrap.py), so the memory needed does not
+    grow with the number of papers.
+    """
+    def __init__(self, stats, cis = (), value = 'citation_boost'):
+        self.value = value
+        self.specs = [(subset, tuple(keys)) for subset, *keys in stats]
+        self.ci_specs = [(subset, tuple(keys)) for subset, *keys in cis]
+        self.cache = {}
+        self.groups = {spec: None for spec in self.ci_specs}
+        self.bootstraps = {spec: bootstrap.PoissonBootstrap() for spec in self.ci_specs}
+        self.intervals = {}
+
+    def add(self, subsets):
+        """
+        Add a partition, given as a dictionary subset name -> its papers in the partition
+        """
+        for subset, keys in self.specs:
+            part = group_stats(subsets[subset], keys, self.value, quantiles = ())
+            self.cache[(subset, keys)] = merge_stats([self.cache.get((subset, keys)), part])
+        for subset, keys in self.ci_specs:
+            # Groups are numbered in the order they are first seen
+            codes, index = factorize(subsets[subset], keys)
+            groups = self.groups[(subset, keys)]
+            groups = index if groups is None else groups.append(index[groups.get_indexer(index) < 0])
+            rows = np.append(groups.get_indexer(index), -1) # Missing keys (code -1) stay -1
+            self.groups[(subset, keys)] = groups
+            self.bootstraps[(subset, keys)].add(rows[codes], subsets[subset][self.value].to_numpy(dtype = float))
+
+    def stats(self, subset, *keys):
+        """
+        Merged statistics of the given subset grouped by the given keys (no quantiles)
+        """
+        return self.cache[(subset, keys)]
+
+    def ci(self, subset, *keys):
+        """
+        Poisson bootstrap confidence intervals of the mean of the given subset grouped by
+        the given keys, indexed by the (sorted) keys
+        """
+        if (subset, keys) not in self.intervals:
+            intervals = self.bootstraps.pop((subset, keys)).intervals()
+            self.intervals[(subset, keys)] = pd.DataFrame(intervals, index = self.groups[(subset, keys)],
+                                                          columns = ['low', 'high']).sort_index()
+        return self.intervals[(subset, keys)]
@@ -1,9 +1,17 @@
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from datetime import datetime
-from scipy.optimize import curve_fit
-from utils import DEADLINE, load_and_process_data, style_plot, save_plots
+import multiprocessing as mp
+import argparse
+from utils import DEADLINE, load_raw_data, load_and_process_data, style_plot, percent_ticks, save_plots
+from aggregate import Aggregates, ChunkedAggregates
+from bootstrap import mean_ci, PoissonBootstrap
+from listing_index import ListingIndex, LISTING_INDEX
+import mailing_calendar
+import baseline
+from submitters import SubmitterVocabulary, SubmitterStats
+from baseline import fit_func
+from instrument import Stage
 
 weekdays = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
 announce_days = ['Sun', 'Mon', 'Tue', 'Wed', 'Thu']
@@ -12,264 +20,516 @@ announce_days = ['Sun', 'Mon', 'Tue', 'Wed', 'Thu']
 # Load the data
 #####
 
-dat_2015 = load_and_process_data('2015_hep-th')
-dat_2016 = load_and_process_data('2016_hep-th')
-dat_2017 = load_and_process_data('2017_hep-th')
-dat_2018 = load_and_process_data('2018_hep-th')
-dat_2019 = load_and_process_data('2019_hep-th')
-dat_2020 = load_and_process_data('2020_hep-th')
-
-dat_list = (dat_2015, dat_2016, dat_2017, dat_2018, dat_2019, dat_2020)
-
-dat_all = pd.concat(dat_list)
-dat_recent = pd.concat(dat_list[2:]) # 2015, 2016 had a different submission deadline
+CATEGORY = 'hep-th'
+YEARS = list(range(2015, 2021))
+FIRST_RECENT = 2017 # 2015, 2016 had a different submission deadline
+
+def make_subsets(dat_all, dat_recent):
+    """
+    Subsets of papers the statistics in the figures are computed for
+    """
+    dat_around_deadline = dat_recent.query('hour >= 13 and hour < 15')
+    dat_around_deadline = dat_around_deadline.query("weekday not in ('Sat', 'Sun')")
+    quick = dat_recent.query('first_minute')
+    return {'all': dat_all, 'recent': dat_recent, 'around_deadline': dat_around_deadline, 'quick': quick}
+
+SUBMITTER_TREATMENTS = ['first_minute', 'top_listing']
+
+def lucky_papers(dat_recent):
+    """
+    Papers that are top listing, but not submitted in the first minute
+    """
+    return dat_recent.query('rank == 1 and not first_minute')['citation_boost']
+
+def summarize_lucky(lucky):
+    """
+    Number, mean citation boost and its bootstrap confidence interval of the lucky papers
+    """
+    return {'count': len(lucky), 'mean': lucky.mean(), 'ci': mean_ci(lucky)}
+
+def fit_baseline(monthly):
+    """
+    Fit the expected number of citations to the monthly averages (see baseline.py).
+    Returns the monthly timestamps, averages and the fitted parameters.
+    """
+    fit_pars = baseline.cached_fit(monthly, CATEGORY)
+    return (monthly['seconds']/monthly['count']).to_numpy(), (monthly['citations']/monthly['count']).to_numpy(), fit_pars
+
+def load_data(yearly_boost = False):
+    """
+    Load and process all the years. Returns a dictionary with everything the figures
+    need, shared read-only by all of them.
+
+    The citation boost is relative to the expected number of citations at the time of
+    submission, or with `yearly_boost` to the average number of citations of the year.
+    """
+    dat_list = [load_and_process_data(f'{year}_{CATEGORY}') for year in YEARS]
+
+    #####
+    # Average number of citations for each year and month
+    #####
+
+    avg_cit_count = [x['citation_counts'].mean() for x in dat_list]
+    x, y, fit_pars = fit_baseline(baseline.merge_monthly([baseline.monthly_aggregates(x) for x in dat_list]))
+    if not yearly_boost:
+        for dat in dat_list:
+            dat['citation_boost'] = baseline.citation_boost(dat, fit_pars)
+
+    dat_all = pd.concat(dat_list)
+    dat_recent = pd.concat([dat for year, dat in zip(YEARS, dat_list) if year >= FIRST_RECENT])
+
+    # Position of the papers in their mailing, from the listing index (only the papers
+    # not indexed yet are added, the ones no longer in the data are dropped)
+    path = LISTING_INDEX.format(category = CATEGORY)
+    index = ListingIndex.load(path, mailing_calendar.load_holidays())
+    if index.update(dat_all['id'], dat_all['submitted_on']):
+        index.save(path)
+    listing = index.frame(dat_recent['submitted_on'].min().date()).set_index('id')
+    dat_recent['rank'] = dat_recent['id'].map(listing['rank'])
+    dat_recent['first_minute'] = dat_recent['id'].map(listing['first_minute'])
+    dat_recent['top_listing'] = dat_recent['rank'] == 1
+
+    # Per-submitter statistics
+    vocabulary = SubmitterVocabulary.load()
+    dat_recent['submitter_code'] = vocabulary.encode(dat_recent['submitter'])
+    vocabulary.save()
+    submitters = SubmitterStats(SUBMITTER_TREATMENTS)
+    submitters.add(dat_recent['submitter_code'].to_numpy(), dat_recent)
+
+    aggregates = Aggregates(make_subsets(dat_all, dat_recent))
+
+    return {'dat_list': dat_list, 'dat_all': dat_all, 'dat_recent': dat_recent, 'aggregates': aggregates,
+            'submitters': submitters, 'vocabulary': vocabulary,
+            'counts': [len(x) for x in dat_list], 'avg_cit_count': avg_cit_count,
+            'lucky': summarize_lucky(lucky_papers(dat_recent)), 'fit_x': x, 'fit_y': y, 'fit_pars': fit_pars}
+
+def load_data_chunked(names = None, yearly_boost = False):
+    """
+    Same as load_data, but processing one year at a time, so that the memory needed does
+    not grow with the number of years. Only the statistics and confidence intervals the
+    given figures (all by default) need are kept, merged over the years, and the
+    individual papers are not returned. The statistics have no quantiles and the
+    confidence intervals come from a Poisson bootstrap (see bootstrap.py), so they differ
+    slightly from the ones of load_data.
+    """
+    # The baseline is fitted first, from the submission times and citations only
+    monthly = baseline.merge_monthly([
+        baseline.monthly_aggregates(load_raw_data(f'{year}_{CATEGORY}', ['submitted_on', 'citation_counts']))
+        for year in YEARS])
+    x, y, fit_pars = fit_baseline(monthly)
+
+    names = list(FIGURES) if names is None else names
+    aggregates = ChunkedAggregates([stats for name in names for stats in FIGURE_STATS[name]],
+                                   [cis for name in names for cis in FIGURE_CIS[name]])
+
+    # Only the papers of the last window can share it with the papers of the next year
+    index = ListingIndex(mailing_calendar.load_holidays())
+    vocabulary = SubmitterVocabulary.load()
+    submitters = SubmitterStats(SUBMITTER_TREATMENTS)
+
+    counts, avg_cit_count = [], []
+    lucky = {'count': 0, 'total': 0.0, 'bootstrap': PoissonBootstrap(num_groups = 1)}
+    for year in YEARS:
+        dat = load_and_process_data(f'{year}_{CATEGORY}', columns = ['id', 'submitter'])
+        dat['submitter'] = vocabulary.encode(dat['submitter'])
+        counts.append(len(dat))
+        avg_cit_count.append(dat['citation_counts'].mean())
+        if not yearly_boost:
+            dat['citation_boost'] = baseline.citation_boost(dat, fit_pars)
+
+        index.add(dat['id'], dat['submitted_on'])
+        listing = index.frame(dat['submitted_on'].min().date()).set_index('id')
+        dat['rank'] = dat['id'].map(listing['rank']).astype(np.int16)
+        dat['first_minute'] = dat['id'].map(listing['first_minute']).astype(bool)
+        dat['top_listing'] = dat['rank'] == 1
+        index.keep_last()
+
+        dat_recent = dat if year >= FIRST_RECENT else dat.iloc[:0]
+        aggregates.add(make_subsets(dat, dat_recent))
+        submitters.add(dat_recent['submitter'].to_numpy(), dat_recent)
+        values = lucky_papers(dat_recent).to_numpy(dtype = float)
+        lucky['count'] += len(values)
+        lucky['total'] += values.sum()
+        lucky['bootstrap'].add(np.zeros(len(values), dtype = int), values)
+        del dat, dat_recent, listing
+    vocabulary.save()
+
+    return {'aggregates': aggregates, 'submitters': submitters, 'vocabulary': vocabulary,
+            'counts': counts, 'avg_cit_count': avg_cit_count,
+            'lucky': {'count': lucky['count'], 'mean': lucky['total']/lucky['count'] if lucky['count'] else np.nan,
+                      'ci': tuple(lucky['bootstrap'].intervals()[0])},
+            'fit_x': x, 'fit_y': y, 'fit_pars': fit_pars}
 
 #####
-# Average number of citations for each year
+# Figures. Every figure is a job registered under its name, which renders and saves the
+# figure given the shared data.
 #####
 
-years = np.arange(2015, 2021)
-avg_cit_count = [x['citation_counts'].mean() for x in dat_list]
-
-# Fit an exponential function timestamp -> expected number of citations
-def fit_func(x, amp, c, shift):
-    return amp*(1 - np.exp(c * (x/1e9 - shift)))
-x = np.array([datetime.strptime(str(year) + '-06-30', '%Y-%m-%d').timestamp() for year in years])
-fit_pars = curve_fit(fit_func, x, avg_cit_count, p0 = (29.6, 10, 1.62))[0]
-
-# Output a plot showing how good the fit is
-plt.scatter(x, avg_cit_count)
-plt.plot(x, fit_func(x, *fit_pars))
-plt.xlabel('timestamp')
-plt.ylabel('Average number of citations')
-plt.savefig('img/arxiv_citation_fit.png', bbox_inches = 'tight')
-
-# If we want to calculate citation boost more accurately, we now can. Does not seem to
-# change conclusions so we will ignore it.
-dat_recent['timestamp'] = [x.timestamp() for x in dat_recent['submitted_on']]
-dat_recent['citation_boost_accurate'] = 100*(dat_recent['citation_counts'] / fit_func(dat_recent['timestamp'], *fit_pars)-1)
-
-##### Summary statistics
-
-years = range(2015, 2021)
-counts = [len(x) for x in dat_list]
-avg_cit_count = [x['citation_counts'].mean() for x in dat_list]
-
-f, axs = plt.subplots(1,2, figsize=(12,3),dpi=300)
-
-axs[0].bar(years, counts,        color = 'goldenrod')
-axs[1].bar(years, avg_cit_count, color = 'goldenrod')
-
-axs[0].set_title('Number of submissions',       fontfamily = 'Arial Black', pad = 20)
-axs[1].set_title('Average number of citations', fontfamily = 'Arial Black', pad = 20)
-axs[0].set_xlabel('Submission year')
-axs[1].set_xlabel('Submission year')
-
-style_plot(axs)
-
-save_plots(f, axs, 'arxiv_summary')
-
-##### Day of submission
-
-counts = dat_all.groupby('weekday')['citation_boost'].count()
-counts = [counts[wd] for wd in weekdays] # Order Mon-Sun
-
-means = dat_all.groupby('weekday')['citation_boost'].mean()
-avg_cit_count = [means[wd] for wd in weekdays]
-
-f, axs = plt.subplots(1,2, figsize=(12,3),dpi=300)
-
-axs[0].bar(range(7), counts,        color = 'goldenrod')
-axs[1].bar(range(7), avg_cit_count, color = 'goldenrod')
-axs[1].axhline(0, color = 'black', lw = 0.6)
+FIGURES = {}
+FIGURE_STATS = {}
+FIGURE_CIS = {}
+
+def figure(name, stats = (), cis = ()):
+    """
+    Register the decorated function as the job rendering the figure `name`. `stats` and
+    `cis` list the (subset, *keys) statistics and confidence intervals it takes from the
+    aggregates.
+    """
+    def register(plot):
+        FIGURES[name] = plot
+        FIGURE_STATS[name] = stats
+        FIGURE_CIS[name] = cis
+        return plot
+    return register
+
+@figure('citation_fit')
+def plot_citation_fit(data):
+    """
+    Output a plot showing how good the fit is
+    """
+    x, avg_cit_count, fit_pars = data['fit_x'], data['fit_y'], data['fit_pars']
+
+    plt.figure()
+    plt.scatter(x, avg_cit_count)
+    plt.plot(x, fit_func(x, *fit_pars))
+    plt.xlabel('timestamp')
+    plt.ylabel('Average number of citations')
+    plt.savefig('img/arxiv_citation_fit.png', bbox_inches = 'tight')
+
+@figure('summary')
+def plot_summary(data):
+    """
+    Summary statistics
+    """
+    years = YEARS
+    counts = data['counts']
+    avg_cit_count = data['avg_cit_count']
+
+    f, axs = plt.subplots(1,2, figsize=(12,3),dpi=300)
+
+    axs[0].bar(years, counts,        color = 'goldenrod')
+    axs[1].bar(years, avg_cit_count, color = 'goldenrod')
+
+    axs[0].set_title('Number of submissions',       fontfamily = 'Arial Black', pad = 20)
+    axs[1].set_title('Average number of citations', fontfamily = 'Arial Black', pad = 20)
+    axs[0].set_xlabel('Submission year')
+    axs[1].set_xlabel('Submission year')
+
+    style_plot(axs)
+
+    save_plots(f, axs, 'arxiv_summary')
+
+@figure('weekdays', stats = [('all', 'weekday')])
+def plot_weekdays(data):
+    """
+    Day of submission
+    """
+    aggregates = data['aggregates']
+
+    stats = aggregates.stats('all', 'weekday')
+    counts = [stats['count'][wd] for wd in weekdays] # Order Mon-Sun
+    avg_cit_count = [stats['mean'][wd] for wd in weekdays]
+
+    f, axs = plt.subplots(1,2, figsize=(12,3),dpi=300)
+
+    axs[0].bar(range(7), counts,        color = 'goldenrod')
+    axs[1].bar(range(7), avg_cit_count, color = 'goldenrod')
+    axs[1].axhline(0, color = 'black', lw = 0.6)
+
+    axs[0].set_title('Number of submissions', fontfamily = 'Arial Black', pad = 20)
+    axs[1].set_title('Excess citations',      fontfamily = 'Arial Black', pad = 20)
+    axs[0].set_xlabel('Day of submission')
+    axs[1].set_xlabel('Day of submission')
+
+    axs[0].set_xticks(range(7), weekdays)
+    axs[1].set_xticks(range(7), weekdays)
+    percent_ticks(axs[1])
+
+    style_plot(axs)
+    save_plots(f, axs, 'arxiv_weekdays')
+
+@figure('hours', stats = [('recent', 'hour')])
+def plot_hours(data):
+    """
+    Hour of submission
+    """
+    aggregates = data['aggregates']
+
+    stats = aggregates.stats('recent', 'hour')
+    avg_cit_count = stats['mean']
+    counts = stats['count']
+
+    f, axs = plt.subplots(1,2, figsize=(12,3),dpi=300)
+
+    axs[0].bar(range(24), counts,        color = 'goldenrod')
+    axs[1].bar(range(24), avg_cit_count, color = 'goldenrod')
+    axs[1].axhline(0, color = 'black', lw = 0.6)
+
+    axs[0].set_title('Number of submissions', fontfamily = 'Arial Black', pad = 20)
+    axs[1].set_title('Excess citations',      fontfamily = 'Arial Black', pad = 20)
+    axs[0].set_xlabel('Time of submission')
+    axs[1].set_xlabel('Time of submission')
+
+    axs[0].axvline(DEADLINE - 0.5, color = 'k', ls = '--')
+    axs[1].axvline(DEADLINE - 0.5, color = 'k', ls = '--')
+    ymax = axs[0].get_ylim()[1]
+    axs[0].text(DEADLINE - 5.3, 0.97*ymax, 'Deadline', fontfamily = 'Arial Black')
+
+    axs[0].set_xticks([0,4,8,12,16,20,24], ['midnight', '4 am', '8 am', 'noon', '4 pm', '8 pm', 'EST/EDT'])
+    axs[1].set_xticks([0,4,8,12,16,20,24], ['midnight', '4 am', '8 am', 'noon', '4 pm', '8 pm', 'EST/EDT'])
+    percent_ticks(axs[1])
 
-axs[0].set_title('Number of submissions', fontfamily = 'Arial Black', pad = 20)
-axs[1].set_title('Excess citations',      fontfamily = 'Arial Black', pad = 20)
-axs[0].set_xlabel('Day of submission')
-axs[1].set_xlabel('Day of submission')
+    style_plot(axs)
 
-axs[0].set_xticks(range(7), weekdays)
-axs[1].set_xticks(range(7), weekdays)
-axs[1].set_yticks([-30, -20, -10, 0, 10], ['-30%', '-20%', '-10%', '0%', '10%'])
+    save_plots(f, axs, 'arxiv_hours')
 
-style_plot(axs)
-save_plots(f, axs, 'arxiv_weekdays')
+@figure('announced_on', stats = [('recent', 'announced_on')])
+def plot_announced_on(data):
+    """
+    Announcement day
+    """
+    aggregates = data['aggregates']
 
-##### Hour of submission
+    stats = aggregates.stats('recent', 'announced_on')
+    counts = [stats['count'][ad] for ad in announce_days] # Order Sun - Thu
+    avg_cit_count = [stats['mean'][ad] for ad in announce_days]
 
-avg_cit_count = dat_recent.groupby('hour')['citation_boost'].mean()
-counts = dat_recent.groupby('hour')['citation_boost'].count()
+    f, axs = plt.subplots(1,2, figsize=(12,3),dpi=300)
 
-f, axs = plt.subplots(1,2, figsize=(12,3),dpi=300)
+    axs[0].bar(range(5), counts,        color = 'goldenrod')
+    axs[1].bar(range(5), avg_cit_count, color = 'goldenrod')
+    axs[1].axhline(0, color = 'black', lw = 0.6)
 
-axs[0].bar(range(24), counts,        color = 'goldenrod')
-axs[1].bar(range(24), avg_cit_count, color = 'goldenrod')
-axs[1].axhline(0, color = 'black', lw = 0.6)
+    axs[0].set_title('Number of submissions', fontfamily = 'Arial Black', pad = 20)
+    axs[1].set_title('Excess citations',      fontfamily = 'Arial Black', pad = 20)
+    axs[0].set_xlabel('Day of announcement')
+    axs[1].set_xlabel('Day of announcement')
 
-axs[0].set_title('Number of submissions', fontfamily = 'Arial Black', pad = 20)
-axs[1].set_title('Excess citations',      fontfamily = 'Arial Black', pad = 20)
-axs[0].set_xlabel('Time of submission')
-axs[1].set_xlabel('Time of submission')
+    axs[0].set_xticks(range(5), announce_days)
+    axs[1].set_xticks(range(5), announce_days)
+    percent_ticks(axs[1])
 
-axs[0].axvline(DEADLINE - 0.5, color = 'k', ls = '--')
-axs[1].axvline(DEADLINE - 0.5, color = 'k', ls = '--')
-ymax = axs[0].get_ylim()[1]
-axs[0].text(DEADLINE - 5.3, 0.97*ymax, 'Deadline', fontfamily = 'Arial Black')
+    style_plot(axs)
 
-axs[0].set_xticks([0,4,8,12,16,20,24], ['midnight', '4 am', '8 am', 'noon', '4 pm', '8 pm', 'EST/EDT'])
-axs[1].set_xticks([0,4,8,12,16,20,24], ['midnight', '4 am', '8 am', 'noon', '4 pm', '8 pm', 'EST/EDT'])
-axs[1].set_yticks([-40,-20,0,20,40], ['-40%', '-20%', '0%', '20%', '40%'])
+    save_plots(f, axs, 'arxiv_announced_on')
 
-style_plot(axs)
+@figure('split_weekdays', stats = [('recent', 'after_deadline', 'weekday')])
+def plot_split_weekdays(data):
+    """
+    Day of submission, before/after deadline
+    """
+    aggregates = data['aggregates']
 
-save_plots(f, axs, 'arxiv_hours')
+    stats = aggregates.stats('recent', 'after_deadline', 'weekday')
 
-##### Announcement day
+    before_avg_cit_count = [stats['mean'][False, wd] for wd in weekdays]
+    before_counts = [stats['count'][False, wd] for wd in weekdays]
 
-counts = dat_recent.groupby('announced_on')['citation_boost'].count()
-counts = [counts[ad] for ad in announce_days] # Order Sun - Thu
+    after_avg_cit_count = [stats['mean'][True, wd] for wd in weekdays]
+    after_counts = [stats['count'][True, wd] for wd in weekdays]
 
-means = dat_recent.groupby('announced_on')['citation_boost'].mean()
-avg_cit_count = [means[ad] for ad in announce_days]
+    f, axs = plt.subplots(1,2, figsize=(12,3),dpi=300)
 
-f, axs = plt.subplots(1,2, figsize=(12,3),dpi=300)
+    axs[0].bar(np.arange(7) - 0.2, before_counts, color = 'goldenrod', width = 0.4, label = 'Before 2 pm')
+    axs[1].bar(np.arange(7) - 0.2, before_avg_cit_count, color = 'goldenrod', width = 0.4)
+    axs[0].bar(np.arange(7) + 0.2, after_counts, color = 'cornflowerblue', width = 0.4, label = 'After 2 pm')
+    axs[1].bar(np.arange(7) + 0.2, after_avg_cit_count, color = 'cornflowerblue', width = 0.4)
+    axs[1].axhline(0, color = 'black', lw = 0.6)
 
-axs[0].bar(range(5), counts,        color = 'goldenrod')
-axs[1].bar(range(5), avg_cit_count, color = 'goldenrod')
-axs[1].axhline(0, color = 'black', lw = 0.6)
+    axs[0].set_title('Number of submissions', fontfamily = 'Arial Black', pad = 20)
+    axs[1].set_title('Excess citations', fontfamily = 'Arial Black', pad = 20)
+    axs[0].set_xlabel('Day of submission')
+    axs[1].set_xlabel('Day of submission')
 
-axs[0].set_title('Number of submissions', fontfamily = 'Arial Black', pad = 20)
-axs[1].set_title('Excess citations',      fontfamily = 'Arial Black', pad = 20)
-axs[0].set_xlabel('Day of announcement')
-axs[1].set_xlabel('Day of announcement')
+    axs[0].legend()
 
-axs[0].set_xticks(range(5), announce_days)
-axs[1].set_xticks(range(5), announce_days)
-axs[1].set_yticks([-10, 0, 10], ['-10%', '0%', '10%'])
+    axs[0].set_xticks(range(7), weekdays)
+    axs[1].set_xticks(range(7), weekdays)
+    percent_ticks(axs[1])
 
-style_plot(axs)
+    style_plot(axs)
 
-save_plots(f, axs, 'arxiv_announced_on')
+    save_plots(f, axs, 'arxiv_split_weekdays')
 
-##### Day of submission, before/after deadline
+@figure('zoom_hours', stats = [('around_deadline', 'time')])
+def plot_zoom_hours(data):
+    """
+    Time of submission, +- 1 hour only
+    """
+    aggregates = data['aggregates']
 
-means = dat_recent[dat_recent['after_deadline'] == 0].groupby('weekday')['citation_boost'].mean()
-before_avg_cit_count = [means[wd] for wd in weekdays]
+    stats = aggregates.stats('around_deadline', 'time')
+    counts = stats['count']
+    avg_cit_count = stats['mean']
 
-counts = dat_recent[dat_recent['after_deadline'] == 0].groupby('weekday')['citation_boost'].count()
-before_counts = [counts[wd] for wd in weekdays]
+    f, axs = plt.subplots(1,2, figsize=(12,3),dpi=300)
 
-means = dat_recent[dat_recent['after_deadline'] == 1].groupby('weekday')['citation_boost'].mean()
-after_avg_cit_count = [means[wd] for wd in weekdays]
+    axs[0].bar(np.arange(12), counts,        color = 'goldenrod')
+    axs[1].bar(np.arange(12), avg_cit_count, color = 'goldenrod')
+    axs[1].axhline(0, color = 'black', lw = 0.6)
 
-counts = dat_recent[dat_recent['after_deadline'] == 1].groupby('weekday')['citation_boost'].count()
-after_counts = [counts[wd] for wd in weekdays]
+    axs[0].set_title('Number of submissions', fontfamily = 'Arial Black', pad = 20)
+    axs[1].set_title('Excess citations',      fontfamily = 'Arial Black', pad = 20)
+    axs[0].set_xlabel('Time of submission')
+    axs[1].set_xlabel('Time of submission')
 
-f, axs = plt.subplots(1,2, figsize=(12,3),dpi=300)
+    axs[0].set_xticks(2*np.arange(6), counts.index[::2])
+    axs[1].set_xticks(2*np.arange(6), counts.index[::2])
+    percent_ticks(axs[1])
 
-axs[0].bar(np.arange(7) - 0.2, before_counts, color = 'goldenrod', width = 0.4, label = 'Before 2 pm')
-axs[1].bar(np.arange(7) - 0.2, before_avg_cit_count, color = 'goldenrod', width = 0.4)
-axs[0].bar(np.arange(7) + 0.2, after_counts, color = 'cornflowerblue', width = 0.4, label = 'After 2 pm')
-axs[1].bar(np.arange(7) + 0.2, after_avg_cit_count, color = 'cornflowerblue', width = 0.4)
-axs[1].axhline(0, color = 'black', lw = 0.6)
+    style_plot(axs)
 
-axs[0].set_title('Number of submissions', fontfamily = 'Arial Black', pad = 20)
-axs[1].set_title('Excess citations', fontfamily = 'Arial Black', pad = 20)
-axs[0].set_xlabel('Day of submission')
-axs[1].set_xlabel('Day of submission')
+    save_plots(f, axs, 'arxiv_zoom_hours')
 
-axs[0].legend()
+@figure('rank', stats = [('recent', 'rank')], cis = [('recent', 'rank')])
+def plot_rank(data):
+    """
+    Position in the listing
+    """
+    aggregates = data['aggregates']
 
-axs[0].set_xticks(range(7), weekdays)
-axs[1].set_xticks(range(7), weekdays)
-axs[1].set_yticks([-30,-20,-10, 0, 10,20], ['-30%', '-20%', '-10%', '0%', '10%','20%'])
+    stats = aggregates.stats('recent', 'rank')
+    counts        = stats['count']
+    avg_cit_count = stats['mean']
+    ci            = aggregates.ci('recent', 'rank')
+    errors        = [avg_cit_count - ci['low'], ci['high'] - avg_cit_count]
 
-style_plot(axs)
+    f, axs = plt.subplots(1,2, figsize=(12,3),dpi=300)
 
-save_plots(f, axs, 'arxiv_split_weekdays')
+    axs[0].bar(range(20), counts[:20],        color = 'goldenrod')
+    axs[1].bar(range(20), avg_cit_count[:20], color = 'goldenrod',
+               yerr = [e[:20] for e in errors], error_kw = {'lw': 0.8, 'capsize': 2})
+    axs[1].axhline(0, color = 'black', lw = 0.6)
 
-##### Time of submission, +- 1 hour only
+    axs[0].set_title('Number of submissions', fontfamily = 'Arial Black', pad = 20)
+    axs[1].set_title('Excess citations',      fontfamily = 'Arial Black', pad = 20)
+    axs[0].set_xlabel('Position in the arXiv listing')
+    axs[1].set_xlabel('Position in the arXiv listing')
 
-dat_around_deadline = dat_recent.query('hour >= 13 and hour < 15')
-dat_around_deadline = dat_around_deadline.query("weekday not in ('Sat', 'Sun')")
-counts = dat_around_deadline.groupby(['time'])['citation_boost'].count()
-avg_cit_count = dat_around_deadline.groupby(['time'])['citation_boost'].mean()
+    style_plot(axs)
 
-f, axs = plt.subplots(1,2, figsize=(12,3),dpi=300)
+    axs[0].set_xticks(2*np.arange(10), counts.index[:20:2])
+    axs[1].set_xticks(2*np.arange(10), counts.index[:20:2])
+    percent_ticks(axs[1])
 
-axs[0].bar(np.arange(12), counts,        color = 'goldenrod')
-axs[1].bar(np.arange(12), avg_cit_count, color = 'goldenrod')
-axs[1].axhline(0, color = 'black', lw = 0.6)
+    save_plots(f, axs, 'arxiv_rank')
 
-axs[0].set_title('Number of submissions', fontfamily = 'Arial Black', pad = 20)
-axs[1].set_title('Excess citations',      fontfamily = 'Arial Black', pad = 20)
-axs[0].set_xlabel('Time of submission')
-axs[1].set_xlabel('Time of submission')
+@figure('rank_for_quick', stats = [('quick', 'rank')], cis = [('quick', 'rank')])
+def plot_rank_for_quick(data):
+    """
+    Ranking only for those in the first minute
+    """
+    aggregates = data['aggregates']
 
-axs[0].set_xticks(2*np.arange(6), counts.index[::2])
-axs[1].set_xticks(2*np.arange(6), counts.index[::2])
-axs[1].set_yticks([0, 20,40,60], ['0%', '20%','40%','60%'])
+    stats = aggregates.stats('quick', 'rank')
+    counts        = stats['count']
+    avg_cit_count = stats['mean']
+    ci            = aggregates.ci('quick', 'rank')
+    errors        = [avg_cit_count - ci['low'], ci['high'] - avg_cit_count]
 
-style_plot(axs)
+    f, axs = plt.subplots(1,2, figsize=(12,3),dpi=300)
 
-save_plots(f, axs, 'arxiv_zoom_hours')
+    axs[0].bar(range(6), counts[:6],        color = 'goldenrod')
+    axs[1].bar(range(6), avg_cit_count[:6], color = 'goldenrod',
+               yerr = [e[:6] for e in errors], error_kw = {'lw': 0.8, 'capsize': 2})
+    axs[1].axhline(0, color = 'black', lw = 0.6)
 
-##### Position in the listing
+    axs[0].set_title('Number of submissions (first minute only)', fontfamily = 'Arial Black', pad = 20)
+    axs[1].set_title('Excess citations (first minute only)',      fontfamily = 'Arial Black', pad = 20)
+    axs[0].set_xlabel('Position in the arXiv listing')
+    axs[1].set_xlabel('Position in the arXiv listing')
 
-# Find papers that had the common previous deadline, rank them by submission time
-dat_recent['rank'] = dat_recent.groupby('previous_deadline')['submitted_on'].rank().astype(int)
-dat_recent.reset_index()
+    style_plot(axs)
 
-counts        = dat_recent.groupby(['rank'])['citation_boost'].count() 
-avg_cit_count = dat_recent.groupby(['rank'])['citation_boost'].mean()
+    axs[0].set_xticks(np.arange(6), counts.index[:6])
+    axs[1].set_xticks(np.arange(6), counts.index[:6])
+    percent_ticks(axs[1])
 
-f, axs = plt.subplots(1,2, figsize=(12,3),dpi=300)
+    save_plots(f, axs, 'arxiv_rank_for_quick')
 
-axs[0].bar(range(20), counts[:20],        color = 'goldenrod')
-axs[1].bar(range(20), avg_cit_count[:20], color = 'goldenrod')
-axs[1].axhline(0, color = 'black', lw = 0.6)
-
-axs[0].set_title('Number of submissions', fontfamily = 'Arial Black', pad = 20)
-axs[1].set_title('Excess citations',      fontfamily = 'Arial Black', pad = 20)
-axs[0].set_xlabel('Position in the arXiv listing')
-axs[1].set_xlabel('Position in the arXiv listing')
-
-style_plot(axs)
-
-axs[0].set_xticks(2*np.arange(10), counts.index[:20:2])
-axs[1].set_xticks(2*np.arange(10), counts.index[:20:2])
-axs[1].set_yticks([-20, -10, 0, 10,20,30], ['-20%', '-10%', '0%', '10%','20%','30%'])
-
-save_plots(f, axs, 'arxiv_rank')
-
-##### Ranking only for those in the first minute
-
-quick = dat_recent.query('hour == 14 and minute == 0 and weekday not in ("Sat", "Sun")')
-
-counts        = quick.groupby('rank')['citation_boost'].count() 
-avg_cit_count = quick.groupby('rank')['citation_boost'].mean()
-
-f, axs = plt.subplots(1,2, figsize=(12,3),dpi=300)
-
-axs[0].bar(range(6), counts[:6],        color = 'goldenrod')
-axs[1].bar(range(6), avg_cit_count[:6], color = 'goldenrod')
-axs[1].axhline(0, color = 'black', lw = 0.6)
-
-axs[0].set_title('Number of submissions (first minute only)', fontfamily = 'Arial Black', pad = 20)
-axs[1].set_title('Excess citations (first minute only)',      fontfamily = 'Arial Black', pad = 20)
-axs[0].set_xlabel('Position in the arXiv listing')
-axs[1].set_xlabel('Position in the arXiv listing')
-
-style_plot(axs)
-
-axs[0].set_xticks(np.arange(6), counts.index[:6])
-axs[1].set_xticks(np.arange(6), counts.index[:6])
-axs[1].set_yticks([0, 10,20,30,40,50], ['0%', '10%','20%','30%', '40%', '50%'])
-
-save_plots(f, axs, 'arxiv_rank_for_quick')
-
-##### What if someone is top listing, but not submitted in the first minute?
+#####
+# Rendering the figures in a process pool
+#####
 
-lucky = dat_recent.query('rank == 1 and (hour != 14 or minute != 0 or weekday in ("Sat", "Sun"))')
-print(f'\nThere are {len(lucky)} papers who appeared in the top but were not submitted in the first minute.')
-print(f'They on average have {-lucky["citation_boost"].mean():.2f}% less citations.')
+_data = None
+
+def _init_worker(data):
+    global _data
+    _data = data
+
+def _render(name):
+    FIGURES[name](_data)
+    plt.close('all')
+    return name
+
+def render(data, names = None, processes = None):
+    """
+    Render the given figures (all of them by default) using `processes` processes (all
+    cores by default). The workers are forked, so they share the data with this process
+    instead of getting a copy.
+    """
+    names = list(FIGURES) if names is None else names
+
+    # Compute the statistics before forking, so that the workers share them. The
+    # bootstrap spreads over all the processes on its own.
+    for name in names:
+        for stats in FIGURE_STATS[name]:
+            data['aggregates'].stats(*stats)
+        for cis in FIGURE_CIS[name]:
+            data['aggregates'].ci(*cis)
+
+    if processes == 1:
+        _init_worker(data)
+        for name in names:
+            print(f'Rendered {_render(name)}')
+        return
+
+    context = mp.get_context('fork') if 'fork' in mp.get_all_start_methods() else mp.get_context()
+    with context.Pool(min(processes or mp.cpu_count(), len(names)), _init_worker, (data,)) as pool:
+        for name in pool.imap_unordered(_render, names):
+            print(f'Rendered {name}')
+
+def print_statistics(data):
+    """
+    What if someone is top listing, but not submitted in the first minute?
+    """
+    lucky = data['lucky']
+
+    print(f'\nThere are {lucky["count"]} papers who appeared in the top but were not submitted in the first minute.')
+    low, high = lucky['ci']
+    print(f'They on average have {abs(lucky["mean"]):.2f}% {"more" if lucky["mean"] > 0 else "less"} citations than expected '
+          f'(95% confidence interval {low:+.2f}% to {high:+.2f}%).')
+
+    # Is it who submits? Compare papers of the same submitter.
+    submitters = data['submitters']
+    table = submitters.frame()
+    print(f'\n{len(table)} submitters, {(table["first_minute_rate"] > 0).sum()} of them submitted in the first minute at least once.')
+    for treatment, description in [('first_minute', 'submitted in the first minute'),
+                                   ('top_listing',  'appearing as the first listing')]:
+        within, naive, both = submitters.within_effect(treatment)
+        print(f'Papers {description} have {naive:.2f}% more citations than the rest and {within:.2f}% more '
+              f'than other papers of the same submitter ({both} submitters with both kinds of papers).')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Create plots with results, print some basic statistics')
+    parser.add_argument('figures', nargs = '*', metavar = 'FIGURE',
+                        help = 'figures to render, all by default: ' + ', '.join(FIGURES))
+    parser.add_argument('--processes', type = int, default = None, help = 'number of processes, all cores by default')
+    parser.add_argument('--yearly-boost', action = 'store_true',
+                        help = 'citation boost relative to the yearly average instead of the fitted baseline')
+    parser.add_argument('--chunked', action = 'store_true',
+                        help = 'process one year at a time to bound the memory use (no quantiles, Poisson bootstrap)')
+    args = parser.parse_args()
+    for name in args.figures:
+        if name not in FIGURES:
+            parser.error(f'unknown figure {name}, choose from ' + ', '.join(FIGURES))
+
+    with Stage('load', chunked = args.chunked) as stage:
+        if args.chunked:
+            data = load_data_chunked(args.figures or None, args.yearly_boost)
+        else:
+            data = load_data(args.yearly_boost)
+        stage.rows = sum(data['counts'])
+    with Stage('render', rows = sum(data['counts']), figures = len(args.figures or FIGURES)):
+        render(data, args.figures or None, args.processes)
+    print_statistics(data)
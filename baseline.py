@@ -0,0 +1,88 @@
+"""
+Expected number of citations of a paper given when it was submitted, per category.
+Older papers had more time to collect citations, so the citation counts are compared to
+an exponential fit of the average number of citations in every month of submission
+(weighted by the number of papers). The monthly aggregates can be collected one
+partition at a time and the fitted parameters are saved in data/baseline.json, where
+they are reused as long as the monthly aggregates do not change.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+BASELINE_PATH = 'data/baseline.json'
+P0 = (29.6, 10, 1.62) # Starting point of the fit
+
+# Fit an exponential function timestamp -> expected number of citations
+def fit_func(x, amp, c, shift):
+    return amp*(1 - np.exp(c * (x/1e9 - shift)))
+
+def timestamps(submitted_on):
+    """
+    Submission times as seconds since the epoch (naive times are UTC)
+    """
+    return pd.to_datetime(submitted_on, utc = True).to_numpy(dtype = 'datetime64[s]').astype(np.int64)
+
+def monthly_aggregates(dat):
+    """
+    Number of papers, total number of citations and total submission timestamp for every
+    month of submission (index 'YYYY-MM'). Aggregates of several partitions can be added
+    up with merge_monthly.
+    """
+    seconds = timestamps(dat['submitted_on'])
+    months = seconds.astype('datetime64[s]').astype('datetime64[M]')
+    codes, uniques = pd.factorize(months, sort = True)
+    return pd.DataFrame({
+        'count':     np.bincount(codes, minlength = len(uniques)),
+        'citations': np.bincount(codes, weights = dat['citation_counts'].to_numpy(), minlength = len(uniques)),
+        'seconds':   np.bincount(codes, weights = seconds, minlength = len(uniques)),
+    }, index = pd.Index(np.datetime_as_string(uniques, unit = 'M'), name = 'month'))
+
+def merge_monthly(parts):
+    return pd.concat(parts).groupby(level = 0).sum()
+
+def fit(monthly):
+    """
+    Parameters of fit_func fitted to the monthly averages
+    """
+    from scipy.optimize import curve_fit # Only needed when the cached fit is stale
+    x = monthly['seconds']/monthly['count']
+    y = monthly['citations']/monthly['count']
+    return curve_fit(fit_func, x, y, p0 = P0, sigma = 1/np.sqrt(monthly['count']))[0]
+
+def data_key(monthly):
+    return hashlib.sha256(monthly.to_json(orient = 'split', double_precision = 15).encode()).hexdigest()
+
+def cached_fit(monthly, category, path = BASELINE_PATH):
+    """
+    Same as fit, but reusing the parameters saved for the category in `path` if they
+    were fitted to the same monthly aggregates
+    """
+    saved = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            saved = json.load(f)
+
+    key = data_key(monthly)
+    if saved.get(category, {}).get('key') == key:
+        return np.array(saved[category]['params'])
+
+    params = fit(monthly)
+    saved[category] = {'key': key, 'params': list(params), 'months': len(monthly)}
+    with open(path + '.tmp', 'w') as f:
+        json.dump(saved, f, indent = 1)
+    os.replace(path + '.tmp', path)
+    return params
+
+def expected_citations(submitted_on, params):
+    return fit_func(timestamps(submitted_on), *params)
+
+def citation_boost(dat, params):
+    """
+    Citation boost in %, relative to the expected number of citations of a paper
+    submitted at the same time
+    """
+    return 100*(dat['citation_counts'].to_numpy()/expected_citations(dat['submitted_on'], params) - 1)
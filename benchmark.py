@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of the pipeline on synthetic data. Generates a snapshot in the format of the
+Kaggle arXiv dataset (10k to millions of records), serves citation counts for it with
+mock_inspire.py, and times every stage for one year and category:
+
+    get_data_and_save      - kaggle.py, extract the partition from the snapshot
+    get_citation_count     - inspire_hep.py, one request per paper (a sample of the papers)
+    get_citation_counts    - inspire_hep.py, batched concurrent requests for all the papers
+    load_and_process_data  - utils.py, features of the partition
+    rank                   - listing_index.py, positions of the papers in the listings
+    save_plots             - utils.py, render and crop a two-panel figure
+
+Every stage is timed (best of --repeat runs) and, unless --no-memory, run once more with
+tracemalloc to get its peak memory (Python and NumPy allocations of this process, the peak
+resident memory of the worker processes is reported separately). The results are written
+as JSON, and compared to an earlier report with --compare.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import numpy as np
+import pandas as pd
+import instrument
+
+YEARS = range(2015, 2021)
+CATEGORIES = ['hep-th', 'hep-ph', 'hep-th hep-ph', 'gr-qc hep-th', 'astro-ph.CO', 'math.AG']
+CATEGORY_WEIGHTS = [0.3, 0.25, 0.1, 0.1, 0.15, 0.1]
+NUM_SUBMITTERS = 20000
+RUSH = 0.05 # Fraction of papers submitted right after the deadline
+THRESHOLD = 1.2 # Slowdown reported as a regression by --compare
+
+#####
+# Synthetic data
+#####
+
+LINE = ('{"id":"%s","submitter":"Author %d","authors":"x","title":"t","comments":null,"journal-ref":null,'
+        '"doi":null,"report-no":null,"categories":"%s","license":null,"abstract":"abc","versions":[%s],'
+        '"update_date":"2021-01-01","authors_parsed":%s}\n')
+VERSION = '{"version":"v%d","created":"%s"}'
+
+def generate_snapshot(path, num_records, seed = 0, chunk_size = 100000):
+    """
+    Write a synthetic snapshot with `num_records` records submitted in YEARS. Submitters
+    follow a Zipf-like distribution and a fraction RUSH of the papers is submitted in
+    the first minute after the deadline of the day (Eastern, see mailing_calendar.py).
+    IDs are given in the order of submission and the records are written in ID order,
+    like in the real snapshot.
+    """
+    import mailing_calendar
+    seconds_of = lambda times: mailing_calendar.utc_times(times).astype('datetime64[s]').astype(np.int64)
+    rng = np.random.default_rng(seed)
+    author_lists = ['[' + ','.join(f'["Author{k}","A",""]' for k in range(n)) + ']' for n in range(1, 9)]
+    next_number = {} # Month -> next arXiv number
+
+    # Papers are spread over the (Eastern) days, a chunk is a run of whole days, so that
+    # the chunks follow each other in time
+    days = np.arange(np.datetime64(f'{YEARS[0]}-01-01'), np.datetime64(f'{YEARS[-1] + 1}-01-02'))
+    bounds = seconds_of(pd.DatetimeIndex(days).tz_localize(mailing_calendar.EASTERN))
+    hours = mailing_calendar.deadline_hour(days[:-1]).astype(np.int64)
+    deadlines = seconds_of((pd.DatetimeIndex(days[:-1]) + pd.to_timedelta(hours, unit = 'h')).tz_localize(mailing_calendar.EASTERN))
+    per_day = rng.multinomial(num_records, np.diff(bounds)/(bounds[-1] - bounds[0]))
+    chunk_days = np.unique(np.r_[0, np.searchsorted(np.cumsum(per_day), np.arange(chunk_size, num_records, chunk_size)),
+                                 len(per_day)])
+
+    with open(path, 'w') as f:
+        for first, last in zip(chunk_days[:-1], chunk_days[1:]):
+            day = np.repeat(np.arange(first, last), per_day[first:last])
+            n = len(day)
+            seconds = bounds[day] + (rng.random(n)*(bounds[day + 1] - bounds[day])).astype(np.int64)
+            rush = rng.random(n) < RUSH
+            seconds = np.sort(np.where(rush, deadlines[day] + rng.integers(0, 60, n), seconds))
+            created = pd.to_datetime(seconds, unit = 's').strftime('%a, %d %b %Y %H:%M:%S GMT')
+
+            # Papers are numbered in every month, in the order of submission
+            months = pd.to_datetime(seconds, unit = 's').strftime('%y%m')
+            month_codes, month_names = pd.factorize(months)
+            counts = np.bincount(month_codes, minlength = len(month_names))
+            within = np.arange(n) - np.repeat(np.cumsum(counts) - counts, counts)
+            numbers = np.array([next_number.get(month, 0) for month in month_names], dtype = np.int64)[month_codes] + within
+            for month, count in zip(month_names, counts):
+                next_number[month] = next_number.get(month, 0) + count
+
+            submitters = np.minimum(rng.zipf(1.5, n), NUM_SUBMITTERS)
+            categories = rng.choice(CATEGORIES, n, p = CATEGORY_WEIGHTS)
+            num_versions = rng.integers(1, 4, n)
+            num_authors = rng.integers(0, 8, n)
+            for i in range(n):
+                versions = ','.join([VERSION % (1, created[i])] +
+                                    [VERSION % (k, 'Fri, 1 Jan 2021 00:00:00 GMT') for k in range(2, num_versions[i] + 1)])
+                f.write(LINE % (f'{months[i]}.{numbers[i]:05}', submitters[i], categories[i], versions,
+                                author_lists[num_authors[i]]))
+
+def snapshot_ids(which, data_dir = 'data'):
+    return pd.read_csv(os.path.join(data_dir, which + '.csv'), usecols = ['id'], dtype = str)['id'].to_numpy()
+
+#####
+# Measuring
+#####
+
+def measure(run, repeat = 1, memory = True):
+    """
+    Best wall time of `repeat` calls of run() and, with `memory`, the peak memory (MB)
+    allocated during one more call. run() returns the number of rows it processed.
+
+    tracemalloc only sees the allocations of this process, not of the worker processes
+    (e.g. of get_data_and_save with --processes), so the peak resident memory of the
+    finished child processes is given as well. It is the peak of all the child processes
+    so far, not only of this stage's.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = run()
+        times.append(time.perf_counter() - start)
+    result = {'seconds': min(times), 'rows': rows, 'rows_per_second': rows/min(times) if min(times) > 0 else None}
+    if memory:
+        tracemalloc.start()
+        run()
+        result['peak_memory_mb'] = tracemalloc.get_traced_memory()[1]/2**20
+        tracemalloc.stop()
+        result['children_peak_rss_mb'] = instrument.peak_rss_mb('children')
+    return result
+
+def benchmark(args):
+    """
+    Run all the stages in args.workdir, return the report
+    """
+    import kaggle
+    import inspire_hep
+    import mock_inspire
+    import utils
+    import listing_index
+    import matplotlib.pyplot as plt
+
+    os.makedirs(os.path.join(args.workdir, 'data'), exist_ok = True)
+    os.makedirs(os.path.join(args.workdir, 'img'), exist_ok = True)
+    os.chdir(args.workdir)
+
+    snapshot = args.snapshot or f'snapshot_{args.records}_{args.seed}.json'
+    if not os.path.exists(snapshot):
+        print(f'Generating {args.records} records into {snapshot}')
+        generate_snapshot(snapshot, args.records, args.seed)
+
+    which = f'{args.year}_{args.category}'
+    stages = {}
+    def stage(name, run):
+        print(f'Running {name}')
+        stages[name] = measure(run, args.repeat, not args.no_memory)
+
+    def extract():
+        kaggle.get_data_and_save(args.category, str(args.year), snapshot, 'data', args.processes)
+        return args.records # Records scanned
+    stage('get_data_and_save', extract)
+
+    # Citation counts from the stand-in server
+    arxiv_numbers = snapshot_ids(which)
+    rng = np.random.default_rng(args.seed)
+    server = mock_inspire.serve(dict(zip(arxiv_numbers, rng.integers(0, 100, len(arxiv_numbers)).tolist())))
+    url = f'http://127.0.0.1:{server.server_port}'
+
+    def single():
+        template = inspire_hep.URL_TEMPLATE
+        inspire_hep.URL_TEMPLATE = url + '/api/literature?fields=citation_count&q=arxiv:'
+        try:
+            for arxiv_number in arxiv_numbers[:args.single_requests]:
+                inspire_hep.get_citation_count(arxiv_number)
+        finally:
+            inspire_hep.URL_TEMPLATE = template
+        return min(args.single_requests, len(arxiv_numbers))
+    stage('get_citation_count', single)
+    requests = server.requests
+
+    citation_counts = []
+    def batched():
+        fetcher = inspire_hep.Fetcher(url, workers = 4, rate = 0)
+        citation_counts[:] = fetcher.get_citation_counts(list(arxiv_numbers), batch_size = 100)
+        return len(arxiv_numbers)
+    stage('get_citation_counts', batched)
+    runs = args.repeat + (not args.no_memory)
+    stages['get_citation_counts']['requests'] = (server.requests - requests)//runs
+    server.shutdown()
+    inspire_hep.save_citation_counts(arxiv_numbers, citation_counts, os.path.join('data', which + '_citation_counts.csv'))
+
+    processed = []
+    def process():
+        processed[:] = [utils.load_and_process_data(which)]
+        return len(processed[0])
+    stage('load_and_process_data', process)
+    dat = processed[0]
+
+    def rank():
+        index = listing_index.ListingIndex()
+        index.add(dat['id'], dat['submitted_on'])
+        return len(index.frame())
+    stage('rank', rank)
+
+    def plots():
+        stats = dat.groupby('hour')['citation_boost'].agg(['count', 'mean'])
+        f, axs = plt.subplots(1, 2, figsize = (12, 3), dpi = 300)
+        axs[0].bar(stats.index, stats['count'], color = 'goldenrod')
+        axs[1].bar(stats.index, stats['mean'], color = 'goldenrod')
+        utils.style_plot(axs)
+        utils.save_plots(f, axs, 'benchmark')
+        plt.close(f)
+        return len(dat)
+    stage('save_plots', plots)
+
+    return {
+        'created':   time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'records':   args.records,
+        'partition': which,
+        'processes': args.processes,
+        'platform':  {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+                      'machine': platform.machine(), 'cpus': os.cpu_count()},
+        'stages':    stages,
+    }
+
+def compare(report, baseline_report, threshold = THRESHOLD):
+    """
+    Print the speed of every stage relative to an earlier report. Returns the names of
+    the stages that got slower by more than `threshold`.
+    """
+    regressions = []
+    for name, result in report['stages'].items():
+        before = baseline_report['stages'].get(name)
+        if before is None:
+            continue
+        ratio = result['seconds']/before['seconds']
+        flag = ''
+        if ratio > threshold:
+            regressions.append(name)
+            flag = '  <- slower'
+        print(f'{name:<24} {before["seconds"]:9.3f}s -> {result["seconds"]:9.3f}s  ({ratio:.2f}x){flag}')
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the pipeline on synthetic data')
+    parser.add_argument('--records', type = int, default = 100000, help = 'number of records in the synthetic snapshot')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--snapshot', default = None, help = 'use this snapshot instead of generating one')
+    parser.add_argument('--workdir', default = 'benchmark', help = 'where the data and the snapshot are written')
+    parser.add_argument('--year', type = int, default = 2020)
+    parser.add_argument('--category', default = 'hep-th')
+    parser.add_argument('--processes', type = int, default = 1, help = 'processes for get_data_and_save')
+    parser.add_argument('--single-requests', type = int, default = 200, help = 'papers fetched one by one')
+    parser.add_argument('--repeat', type = int, default = 1, help = 'timed runs of every stage, the best counts')
+    parser.add_argument('--no-memory', action = 'store_true', help = 'skip the (slower) memory profiling runs')
+    parser.add_argument('--output', default = 'benchmark.json', help = 'JSON report')
+    parser.add_argument('--compare', default = None, help = 'earlier JSON report to compare with')
+    args = parser.parse_args()
+    args.output = os.path.abspath(args.output)
+    args.compare = args.compare and os.path.abspath(args.compare)
+    if args.snapshot:
+        args.snapshot = os.path.abspath(args.snapshot)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    report = benchmark(args)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent = 1)
+    print(f'Report written to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(report, json.load(f)):
+                sys.exit(1)
@@ -0,0 +1,131 @@
+"""
+Bootstrap confidence intervals of the mean citation boost. The resampling is done in
+batches with NumPy (a whole batch of resamples is a single fancy-indexing operation) and
+the groups are spread over a process pool. Every group gets its own seed, so the results
+do not depend on the number of processes.
+
+PoissonBootstrap gives the intervals of data seen one partition at a time: every value
+enters every resample a Poisson(1) number of times, so only the weighted sums of every
+group and resample have to be kept, and memory does not grow with the number of values.
+"""
+
+import warnings
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+from grouping import factorize
+
+NUM_RESAMPLES = 10000
+CONFIDENCE = 0.95
+BATCH_ELEMENTS = 2**22 # Resampled values held in memory at once
+POISSON_BATCH_ELEMENTS = 2**19 # Same for PoissonBootstrap, which is meant to keep memory low
+
+def resample_means(values, num_resamples = NUM_RESAMPLES, seed = 0):
+    """
+    Means of `num_resamples` resamples (with replacement) of the given values
+    """
+    rng = np.random.default_rng(seed)
+    n = len(values)
+    batch_size = max(1, BATCH_ELEMENTS // max(n, 1))
+    means = np.empty(num_resamples)
+    for start in range(0, num_resamples, batch_size):
+        stop = min(start + batch_size, num_resamples)
+        means[start:stop] = values[rng.integers(0, n, size = (stop - start, n))].mean(axis = 1)
+    return means
+
+def _interval(args):
+    values, num_resamples, seed, confidence = args
+    if len(values) == 0:
+        return np.nan, np.nan
+    alpha = (1 - confidence)/2
+    low, high = np.quantile(resample_means(values, num_resamples, seed), [alpha, 1 - alpha])
+    return low, high
+
+def mean_ci(values, num_resamples = NUM_RESAMPLES, confidence = CONFIDENCE, seed = 0):
+    """
+    Percentile bootstrap confidence interval (low, high) of the mean of the values
+    """
+    values = np.asarray(values, dtype = float)
+    return _interval((values[~np.isnan(values)], num_resamples, seed, confidence))
+
+def group_ci(dat, keys, value = 'citation_boost', num_resamples = NUM_RESAMPLES,
+             confidence = CONFIDENCE, processes = None, seed = 0):
+    """
+    Percentile bootstrap confidence intervals of the mean of `value` for every group of
+    papers with the same `keys`, computed in `processes` processes (all cores by default).
+    Returns a dataframe indexed by the (sorted) keys with columns 'low' and 'high'.
+    """
+    codes, index = factorize(dat, keys)
+    values = dat[value].to_numpy(dtype = float)
+    valid = (codes >= 0) & ~np.isnan(values)
+    codes, values = codes[valid], values[valid]
+
+    # Split the values into groups
+    order = np.argsort(codes, kind = 'stable')
+    counts = np.bincount(codes, minlength = len(index))
+    groups = np.split(values[order], np.cumsum(counts)[:-1])
+
+    seeds = np.random.SeedSequence(seed).spawn(len(index))
+    tasks = [(group, num_resamples, group_seed, confidence) for group, group_seed in zip(groups, seeds)]
+
+    # Pool workers (e.g. rendering a figure) cannot start processes of their own
+    if processes == 1 or len(tasks) < 2 or mp.current_process().daemon:
+        intervals = list(map(_interval, tasks))
+    else:
+        context = mp.get_context('fork') if 'fork' in mp.get_all_start_methods() else mp.get_context()
+        with context.Pool(min(processes or mp.cpu_count(), len(tasks))) as pool:
+            intervals = pool.map(_interval, tasks)
+
+    return pd.DataFrame(intervals, index = index, columns = ['low', 'high'])
+
+class PoissonBootstrap:
+    """
+    Bootstrap confidence intervals of the mean of groups of values, fed one partition of
+    the values at a time. Keeps the sums of the Poisson(1) weights and of the weighted
+    values of every group in `num_resamples` resamples, O(groups x resamples) memory.
+    The time is not bounded the same way: every value gets `num_resamples` Poisson
+    weights, so adding a partition takes time linear in its number of values.
+    """
+    def __init__(self, num_groups = 0, num_resamples = NUM_RESAMPLES, seed = 0):
+        self.num_resamples = num_resamples
+        self.rng = np.random.default_rng(seed)
+        self.weights = np.zeros((num_groups, num_resamples))
+        self.sums = np.zeros((num_groups, num_resamples))
+
+    def add(self, codes, values):
+        """
+        Add values of the groups with the given codes (0, 1, ...). Values with a negative
+        code or NaN are skipped.
+        """
+        codes, values = np.asarray(codes), np.asarray(values, dtype = float)
+        valid = (codes >= 0) & ~np.isnan(values)
+        codes, values = codes[valid], values[valid]
+        num_groups = max(len(self.sums), codes.max() + 1 if len(codes) else 0)
+        grow = lambda sums: np.pad(sums, ((0, num_groups - len(sums)), (0, 0)))
+        self.weights, self.sums = grow(self.weights), grow(self.sums)
+        if len(codes) == 0:
+            return
+
+        # Values of a group next to each other, so that its weights are summed by reduceat
+        order = np.argsort(codes, kind = 'stable')
+        codes, values = codes[order], values[order]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        groups = codes[starts]
+
+        batch_size = max(1, POISSON_BATCH_ELEMENTS // len(values))
+        for start in range(0, self.num_resamples, batch_size):
+            stop = min(start + batch_size, self.num_resamples)
+            weights = self.rng.poisson(1.0, size = (len(values), stop - start))
+            self.weights[groups, start:stop] += np.add.reduceat(weights, starts, axis = 0)
+            self.sums[groups, start:stop] += np.add.reduceat(weights*values[:, None], starts, axis = 0)
+
+    def intervals(self, confidence = CONFIDENCE):
+        """
+        Percentile confidence intervals, an array with a (low, high) row for every group
+        (NaN for groups without values)
+        """
+        alpha = (1 - confidence)/2
+        with np.errstate(invalid = 'ignore', divide = 'ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning) # Groups without values
+            means = self.sums/self.weights # Resamples that drew no value are NaN
+            return np.nanquantile(means, [alpha, 1 - alpha], axis = 1).T.reshape(-1, 2)
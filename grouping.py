@@ -0,0 +1,44 @@
+"""
+Numbering of the groups of papers with the same values of some keys, shared by the
+grouped statistics (aggregate.py) and the bootstrap (bootstrap.py).
+"""
+
+import numpy as np
+import pandas as pd
+
+def factorize(dat, keys):
+    """
+    Number the observed combinations of `keys` in sorted order (categoricals in the order
+    of their categories, like groupby). Returns the group code of every paper (-1 if any
+    key is missing) and the index of the groups.
+    """
+    codes = np.zeros(len(dat), dtype = np.int64)
+    missing = np.zeros(len(dat), dtype = bool)
+    levels = []
+    for key in keys:
+        if isinstance(dat[key].dtype, pd.CategoricalDtype):
+            key_codes, uniques = dat[key].cat.codes.to_numpy(), pd.CategoricalIndex(dat[key].cat.categories,
+                                                                                  dtype = dat[key].dtype)
+        else:
+            key_codes, uniques = pd.factorize(dat[key], sort = True)
+        missing |= key_codes < 0
+        codes = codes*len(uniques) + key_codes
+        levels.append(uniques)
+
+    # Keep only the combinations that occur
+    num_combinations = int(np.prod([len(level) for level in levels]))
+    if num_combinations <= 10*len(dat) + 1000:
+        present = np.bincount(codes[~missing], minlength = num_combinations) > 0
+        combinations = np.flatnonzero(present)
+        codes = (np.cumsum(present) - 1)[np.where(missing, 0, codes)]
+    else:
+        combinations, codes = np.unique(np.where(missing, 0, codes), return_inverse = True)
+    codes[missing] = -1
+
+    positions = np.unravel_index(combinations, [len(level) for level in levels])
+    arrays = [level[position] for level, position in zip(levels, positions)]
+    if len(keys) == 1:
+        index = pd.Index(arrays[0], name = keys[0])
+    else:
+        index = pd.MultiIndex.from_arrays(arrays, names = list(keys))
+    return codes, index
@@ -6,23 +6,24 @@ these papers obtained from the inspire hep database (https://inspirehep.net) usi
 API
 """
 
-import urllib.request, json
+import urllib.request, urllib.parse, json
+import http.client
+import sqlite3
+import math
+import threading
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-import sys
-
-if len(sys.argv) == 3:
-    YEAR = sys.argv[1]
-    CATEGORY = sys.argv[2]
-else:
-    print('Usage: python inspire_hep.py YEAR CATEGORY')
-    print('Usage: python inspire_hep.py 2021 hep-th')
-    exit()
+import storage
+import instrument
 
 #####
 # Function that scrapes the number of citation from Inspire Hep
 #####
 
-URL_TEMPLATE = 'https://inspirehep.net/api/literature?fields=citation_count&q=arxiv:' 
+BASE_URL = 'https://inspirehep.net'
+URL_TEMPLATE = BASE_URL + '/api/literature?fields=citation_count&q=arxiv:'
 
 def get_citation_count(arxiv_number):
     """
@@ -30,7 +31,14 @@ def get_citation_count(arxiv_number):
     paper
     """
     url = URL_TEMPLATE + str(arxiv_number)
+    instrument.count_request()
     api_response = json.loads(urllib.request.urlopen(url).read())
+    return parse_citation_count(api_response)
+
+def parse_citation_count(api_response):
+    """
+    Get the number of citations from the API response, None if the paper was not found
+    """
     not_found = len(api_response['hits']['hits']) == 0
     if not_found:
         citation_count = None
@@ -39,22 +47,241 @@ def get_citation_count(arxiv_number):
     return citation_count
 
 #####
-# File with arxiv numbers we are interested in
+# Concurrent fetching
 #####
-    
-arxiv_numbers = pd.read_csv('data/' + YEAR + '_' + CATEGORY + '.csv', usecols = ['id'], dtype = str)['id'].values
-print(f'Loaded {len(arxiv_numbers)} arxiv IDs.')
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class RateLimiter:
+    """
+    Spaces the requests of all threads so that at most `rate` of them start per second
+    """
+    def __init__(self, rate):
+        self.interval = 1/rate if rate else 0
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        time.sleep(start - now)
+
+class Fetcher:
+    """
+    Fetches citation counts from several threads. Every thread keeps its own keep-alive
+    connection to the server, the total request rate is capped and requests that fail
+    with 429/5xx or a dropped connection are retried with exponential backoff.
+    """
+    def __init__(self, base_url = BASE_URL, workers = 4, rate = 3, retries = 5, backoff = 1.0,
+                       timeout = 30):
+        url = urllib.parse.urlsplit(base_url)
+        self.scheme = url.scheme
+        self.netloc = url.netloc
+        self.prefix = url.path.rstrip('/')
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def connection(self):
+        if getattr(self.local, 'connection', None) is None:
+            if self.scheme == 'https':
+                self.local.connection = http.client.HTTPSConnection(self.netloc, timeout = self.timeout)
+            else:
+                self.local.connection = http.client.HTTPConnection(self.netloc, timeout = self.timeout)
+        return self.local.connection
+
+    def reset_connection(self):
+        if getattr(self.local, 'connection', None) is not None:
+            self.local.connection.close()
+        self.local.connection = None
+
+    def get_json(self, path, params):
+        """
+        GET the given API path and return the decoded JSON response
+        """
+        url = self.prefix + path + '?' + urllib.parse.urlencode(params)
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            delay = self.backoff * 2**attempt
+            try:
+                connection = self.connection()
+                instrument.count_request()
+                connection.request('GET', url, headers = {'Accept': 'application/json'})
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError):
+                self.reset_connection()
+                if attempt == self.retries:
+                    raise
+            else:
+                if response.status == 200:
+                    return json.loads(body)
+                if response.status not in RETRY_STATUSES or attempt == self.retries:
+                    raise RuntimeError(f'{url} returned HTTP {response.status}')
+                retry_after = response.getheader('Retry-After')
+                if retry_after is not None and retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+            time.sleep(delay)
+
+    def get_citation_count(self, arxiv_number):
+        """
+        Same as get_citation_count, but reusing the connection of the current thread
+        """
+        api_response = self.get_json('/api/literature', {'fields': 'citation_count',
+                                                         'q': 'arxiv:' + str(arxiv_number)})
+        return parse_citation_count(api_response)
+
+    def get_citation_counts_batch(self, arxiv_numbers):
+        """
+        Get the number of citations of several papers with a single OR-ed query. Papers
+        that are not found get None, same as in get_citation_count.
+        """
+        query = ' or '.join('arxiv:' + str(arxiv_number) for arxiv_number in arxiv_numbers)
+        api_response = self.get_json('/api/literature', {'fields': 'citation_count,arxiv_eprints',
+                                                         'size': 2*len(arxiv_numbers),
+                                                         'q': query})
+
+        # Map the hits back to arxiv IDs, the first hit wins as in get_citation_count
+        citation_counts = {}
+        for hit in api_response['hits']['hits']:
+            for eprint in hit['metadata'].get('arxiv_eprints', []):
+                citation_counts.setdefault(eprint['value'], hit['metadata']['citation_count'])
+
+        # Some hits did not fit into the page, ask for the missing papers one by one
+        truncated = api_response['hits']['total'] > len(api_response['hits']['hits'])
+        return [citation_counts[str(arxiv_number)] if str(arxiv_number) in citation_counts
+                    else (self.get_citation_count(arxiv_number) if truncated else None)
+                for arxiv_number in arxiv_numbers]
+
+    def get_citation_counts(self, arxiv_numbers, batch_size = 1):
+        """
+        Yield the number of citations of the given papers, in the input order. With
+        batch_size > 1, each request asks for up to batch_size papers at once.
+        """
+        with ThreadPoolExecutor(self.workers) as executor:
+            if batch_size == 1:
+                yield from executor.map(self.get_citation_count, arxiv_numbers)
+            else:
+                batches = [arxiv_numbers[i:i + batch_size] for i in range(0, len(arxiv_numbers), batch_size)]
+                for citation_counts in executor.map(self.get_citation_counts_batch, batches):
+                    yield from citation_counts
 
 #####
-# Process them and save results
+# On-disk cache of the citation counts
 #####
 
-out = open('data/' + YEAR + '_' + CATEGORY + '_citation_counts.csv', 'w')
-out.write('id,citation_counts\n')
-for i, arxiv_number in enumerate(arxiv_numbers):
-    if i % 1000 == 0:
-        print(f'Processing {i}-th record')
-    citation_count = get_citation_count(arxiv_number)
-    out.write(arxiv_number + ',' + str(citation_count) + '\n')
+class CitationCache:
+    """
+    SQLite cache arxiv ID -> (citation count, fetch timestamp), shared by all the years
+    and categories. Papers that were not found are cached with a NULL count.
+    """
+    def __init__(self, path = 'data/citations.sqlite'):
+        self.db = sqlite3.connect(path, timeout = 60)
+        self.db.execute('CREATE TABLE IF NOT EXISTS citations '
+                        '(id TEXT PRIMARY KEY, citation_count INTEGER, fetched_at REAL NOT NULL)')
+        self.db.commit()
+
+    def get(self, arxiv_numbers, ttl = None):
+        """
+        Return a dictionary arxiv ID -> citation count of the cached papers fetched less
+        than `ttl` seconds ago (any time ago if ttl is None)
+        """
+        oldest = -math.inf if ttl is None else time.time() - ttl
+        cached = {}
+        arxiv_numbers = list(arxiv_numbers)
+        for i in range(0, len(arxiv_numbers), 500): # SQLite limits the number of parameters
+            chunk = arxiv_numbers[i:i + 500]
+            rows = self.db.execute('SELECT id, citation_count FROM citations WHERE fetched_at >= ? AND id IN ('
+                                   + ','.join('?'*len(chunk)) + ')', [oldest, *chunk])
+            cached.update(rows)
+        return cached
+
+    def put(self, citation_counts):
+        """
+        Store an iterable of (arxiv ID, citation count) pairs
+        """
+        now = time.time()
+        self.db.executemany('INSERT OR REPLACE INTO citations VALUES (?, ?, ?)',
+                            [(arxiv_number, citation_count, now) for arxiv_number, citation_count in citation_counts])
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+def get_citation_counts_cached(fetcher, cache, arxiv_numbers, batch_size = 1, ttl = None, commit_every = 1000):
+    """
+    Return the number of citations of the given papers, in the input order. Only papers
+    missing from the cache or older than `ttl` seconds are fetched. New results are
+    committed to the cache every `commit_every` papers, so an interrupted run can resume.
+    """
+    cached = cache.get(arxiv_numbers, ttl)
+    missing = list(dict.fromkeys(a for a in arxiv_numbers if a not in cached))
+    print(f'{len(cached)} citation counts cached, fetching {len(missing)}.')
+
+    with instrument.Stage('fetch', rows = len(missing), cached = len(cached)):
+        fetched = []
+        for i, citation_count in enumerate(fetcher.get_citation_counts(missing, batch_size)):
+            if i % 1000 == 0:
+                print(f'Processing {i}-th record')
+            fetched.append((missing[i], citation_count))
+            if len(fetched) == commit_every:
+                cache.put(fetched)
+                cached.update(fetched)
+                fetched = []
+        cache.put(fetched)
+        cached.update(fetched)
+
+    return [cached[arxiv_number] for arxiv_number in arxiv_numbers]
+
+def save_citation_counts(arxiv_numbers, citation_counts, path):
+    """
+    Write the citation counts in the format id,citation_counts
+    """
+    with open(path, 'w') as out:
+        out.write('id,citation_counts\n')
+        for arxiv_number, citation_count in zip(arxiv_numbers, citation_counts):
+            out.write(arxiv_number + ',' + str(citation_count) + '\n')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage = 'python inspire_hep.py 2021 hep-th')
+    parser.add_argument('year')
+    parser.add_argument('category')
+    parser.add_argument('--workers', type = int, default = 4, help = 'number of concurrent connections')
+    parser.add_argument('--rate', type = float, default = 3, help = 'maximum number of requests per second')
+    parser.add_argument('--batch-size', type = int, default = 100, help = 'number of papers per request')
+    parser.add_argument('--cache', default = 'data/citations.sqlite', help = 'citation cache shared by all the runs')
+    parser.add_argument('--ttl-days', type = float, default = 30, help = 'refetch cached counts older than this')
+    parser.add_argument('--formats', default = 'csv,parquet', help = 'where to save the results, csv and/or parquet (see storage.py)')
+    parser.add_argument('--url', default = BASE_URL, help = 'INSPIRE server, e.g. a local stand-in')
+    args = parser.parse_args()
+
+    #####
+    # File with arxiv numbers we are interested in
+    #####
+
+    which = args.year + '_' + args.category
+    if storage.has_parquet(which):
+        arxiv_numbers = storage.read_partition(which, ['id'])['id'].values
+    else:
+        arxiv_numbers = pd.read_csv('data/' + which + '.csv', usecols = ['id'], dtype = str)['id'].values
+    print(f'Loaded {len(arxiv_numbers)} arxiv IDs.')
+
+    #####
+    # Process them and save results
+    #####
 
-out.close()
+    fetcher = Fetcher(args.url, workers = args.workers, rate = args.rate)
+    cache = CitationCache(args.cache)
+    citation_counts = get_citation_counts_cached(fetcher, cache, arxiv_numbers, args.batch_size,
+                                                 ttl = args.ttl_days*24*3600)
+    cache.close()
+    formats = args.formats.split(',')
+    if 'csv' in formats:
+        save_citation_counts(arxiv_numbers, citation_counts, 'data/' + which + '_citation_counts.csv')
+    if 'parquet' in formats:
+        storage.write_citations(arxiv_numbers, citation_counts, which)
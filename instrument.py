@@ -0,0 +1,116 @@
+"""
+Timing and memory of the stages of the scripts. A stage is a block of code wrapped in
+
+    with Stage('fetch', partition = '2020_hep-th') as stage:
+        ...
+        stage.rows = len(arxiv_numbers)
+
+which, when it ends, writes one JSON line with its name, the given fields, the wall
+time, the rows processed per second, the peak resident memory (RSS) of the process and
+of its finished child processes so far, and the number of HTTP requests sent during the
+stage. The lines are appended to the file named by the environment variable
+ARXIV_INSTRUMENT_LOG ('-' for stderr); without it nothing is written.
+
+Stages can be nested, e.g. the stages of pipeline.py contain the ones of the scripts it
+runs. The peak RSS is the peak of the whole run up to the end of the stage, as reported
+by the operating system.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+LOG_ENV = 'ARXIV_INSTRUMENT_LOG'
+
+#####
+# Counters
+#####
+
+_requests = 0
+_requests_lock = threading.Lock()
+
+def count_request():
+    """
+    Count one HTTP request, called by inspire_hep.py for every request it sends
+    (including retries)
+    """
+    global _requests
+    with _requests_lock:
+        _requests += 1
+
+def http_requests():
+    """
+    Number of HTTP requests sent by this process so far
+    """
+    return _requests
+
+def peak_rss_mb(who = 'self'):
+    """
+    Peak resident memory in MB of this process ('self') or of its finished child
+    processes ('children'), None where it is not available
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    return usage.ru_maxrss/(2**20 if sys.platform == 'darwin' else 2**10)
+
+#####
+# Stages
+#####
+
+def emit(record, path = None):
+    """
+    Append the record as a JSON line to `path` (by default the file named by the
+    environment variable ARXIV_INSTRUMENT_LOG, '-' for stderr). Does nothing without a
+    path.
+    """
+    path = path or os.environ.get(LOG_ENV)
+    if not path:
+        return
+    line = json.dumps(record, default = str) + '\n'
+    if path == '-':
+        sys.stderr.write(line)
+    else:
+        with open(path, 'a') as f:
+            f.write(line)
+
+class Stage:
+    """
+    Context manager measuring a stage, see the top of the file. `rows` (the number of
+    rows processed) can be given upfront or set on the stage before it ends.
+    """
+    def __init__(self, name, rows = None, log = None, **fields):
+        self.name = name
+        self.rows = rows
+        self.log = log
+        self.fields = fields
+
+    def __enter__(self):
+        self.requests = http_requests()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        rows = None if self.rows is None else int(self.rows)
+        self.record = {
+            'stage':                self.name,
+            **self.fields,
+            'status':               'ok' if exc_type is None else 'error',
+            'time':                 time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'seconds':              seconds,
+            'rows':                 rows,
+            'rows_per_second':      rows/seconds if rows is not None and seconds > 0 else None,
+            'peak_rss_mb':          peak_rss_mb('self'),
+            'children_peak_rss_mb': peak_rss_mb('children'),
+            'http_requests':        http_requests() - self.requests,
+        }
+        emit(self.record, self.log)
+        return False
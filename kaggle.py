@@ -8,6 +8,10 @@ Uses the official Kaggle arXiv Dataset (https://www.kaggle.com/Cornell-Universit
 import numpy as np
 import pandas as pd
 import json
+import os
+import multiprocessing as mp
+import storage
+import instrument
 
 months_dict = {'Jan': '01', 'Feb': '02', 'Mar': '03', 'Apr': '04', 'May': '05', 'Jun' : '06',
               'Jul': '07', 'Aug': '08', 'Sep': '09', 'Oct': '10', 'Nov': '11', 'Dec': '12'}
@@ -23,42 +27,291 @@ def get_clean_authors(authors):
         r.append(" ".join(a).strip())
     return r
 
-def get_data_and_save(category, pick_year):
+SNAPSHOT = "../input/arxiv/arxiv-metadata-oai-snapshot.json"
+
+COLUMNS = ['id', 'submitter', 'weekday', 'submitted_on', 'num_authors']
+
+def parse_created(created):
     """
-    Saves information about arxiv articles from the given category and year.
+    Convert the creation time of the first version (e.g. 'Mon, 2 Apr 2007 19:18:42 GMT')
+    into the weekday and a datetime string.
+    """
+    splitted = created.split(' ')
+    weekday = splitted[0][:-1]
+    day = int(splitted[1])
+    month = months_dict[splitted[2]]
+    year = splitted[3]
+    time = splitted[4]
+    return weekday, f'{year}-{month}-{day:02} {time}'
+
+def matching_targets(d, targets):
+    """
+    Return the (category, year) targets the given arXiv record belongs to.
+    """
+    # Only the primary classification. Note that we can have astro-ph.CO and similar, so we strip the ending.
+    primary = d['categories'].split(' ')[0]
+    created = d['versions'][0]['created']
+    return [(category, pick_year) for category, pick_year in targets
+                if category in primary[:len(category)] and pick_year in created]
+
+def byte_ranges(snapshot, num_ranges):
     """
-    articles = []
-    with open("../input/arxiv/arxiv-metadata-oai-snapshot.json", "r") as f:
-        for l in f:
+    Split the JSON-lines snapshot into (start, end) byte ranges aligned to the line ends.
+    """
+    size = os.path.getsize(snapshot)
+    bounds = [0]
+    with open(snapshot, "rb") as f:
+        for i in range(1, num_ranges):
+            f.seek(max(size * i // num_ranges, bounds[-1]))
+            f.readline() # Move to the start of the next line
+            bounds.append(min(f.tell(), size))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if start < end]
+
+def field_prefix(l, key, length):
+    """
+    Return the first `length` bytes of the value of the first `key` string field in the raw
+    snapshot line, or None if the field is not written in the compact form '"key":"'.
+    """
+    marker = b'"' + key + b'":"'
+    i = l.find(marker)
+    if i < 0:
+        return None
+    i += len(marker)
+    return l[i:i + length]
+
+def might_match(l, categories, years):
+    """
+    Cheap test on the raw bytes of a snapshot line. Returns False only for records that
+    surely do not belong to any target, so that we can skip decoding their JSON.
+    """
+    # Quotes inside string values are escaped, so the first '"categories":"' is the real key.
+    primary = field_prefix(l, b'categories', max((len(c) for c in categories), default = 0))
+    if primary is None:
+        if not any(c in l for c in categories):
+            return False
+    elif not any(primary.startswith(c) for c in categories):
+        return False
+
+    # The first 'created' field belongs to the first version
+    created = field_prefix(l, b'created', 40)
+    if created is None:
+        created = l
+    return any(y in created for y in years)
+
+def raw_signature(l):
+    """
+    Get the (arXiv ID, number of versions) signature of a record from the raw bytes of its
+    snapshot line, or None if the line is not written in the compact form.
+    """
+    arxiv_id = field_prefix(l, b'id', 64)
+    start = l.find(b'"versions":[')
+    if arxiv_id is None or start < 0:
+        return None
+    end = l.find(b']', start)
+    return arxiv_id.split(b'"')[0].decode(), l.count(b'"version":', start, end)
+
+def get_data_range(snapshot, targets, start, end, known = None):
+    """
+    Parse the lines of the snapshot starting in the byte range [start, end). Records whose
+    (arXiv ID, number of versions) signature is in `known` are skipped, records of `known`
+    with a new version are always decoded, whether they still match or not. Returns a
+    dictionary target -> columns (dictionary column name -> list of values) and a
+    dictionary arXiv ID -> number of versions of all the decoded records.
+    """
+    columns = {target: {column: [] for column in COLUMNS} for target in targets}
+    seen = {}
+    categories = {category.encode() for category, _ in targets}
+    years = {pick_year.encode() for _, pick_year in targets}
+    with open(snapshot, "rb") as f:
+        f.seek(start)
+        position = start
+        while position < end:
+            l = f.readline()
+            if not l:
+                break
+            position += len(l)
+
+            # Skip records that did not change since the last extraction. Records extracted
+            # before that got a new version are decoded even if they no longer look like a
+            # match (e.g. they moved to another category), so that their old rows are dropped.
+            extracted = False
+            if known:
+                signature = raw_signature(l)
+                if signature is None: # Not in the compact form, decode to find out
+                    d = json.loads(l)
+                    signature = d['id'], len(d['versions'])
+                if known.get(signature[0]) == signature[1]:
+                    continue
+                extracted = signature[0] in known
+
+            # Only decode records that can possibly match
+            if not extracted and not might_match(l, categories, years):
+                continue
+
             d = json.loads(l)
-            # Only the primary classification. Note that we can have astro-ph.CO and similar, so we strip the ending.
-            if category in d['categories'].split(' ')[0][:len(category)]:
-                if pick_year in d['versions'][0]['created']:
-                    num_authors = len(get_clean_authors(d['authors_parsed']))
+            seen[d['id']] = len(d['versions'])
+            for target in matching_targets(d, targets):
+                weekday, datetime_string = parse_created(d['versions'][0]['created'])
+
+                c = columns[target]
+                c['id'].append(d['id'])
+                c['submitter'].append(d['submitter'])
+                c['weekday'].append(weekday)
+                c['submitted_on'].append(datetime_string)
+                c['num_authors'].append(len(get_clean_authors(d['authors_parsed'])))
+
+    return columns, seen
+
+def _get_data_range(args):
+    return get_data_range(*args)
+
+def get_data(targets, snapshot = SNAPSHOT, processes = 1, known = None, seen = None):
+    """
+    Go once through the arXiv snapshot and collect the articles for every (category, year)
+    target. With more than one process, the snapshot is split into byte ranges which are
+    parsed in parallel and merged back in the file order. Returns a dictionary
+    target -> columns (dictionary column name -> list of values).
+
+    Records with an (arXiv ID, number of versions) signature in `known` are skipped. If
+    `seen` is given, the signatures of all decoded records are added to it.
+    """
+    if processes > 1:
+        # More ranges than processes, so that a slow range does not leave cores idle
+        ranges = byte_ranges(snapshot, 4 * processes)
+        with mp.Pool(processes) as pool:
+            chunks = pool.map(_get_data_range, [(snapshot, targets, start, end, known) for start, end in ranges])
+    else:
+        chunks = [get_data_range(snapshot, targets, 0, os.path.getsize(snapshot), known)]
+
+    articles = {target: {column: [] for column in COLUMNS} for target in targets}
+    for chunk, chunk_seen in chunks:
+        if seen is not None:
+            seen.update(chunk_seen)
+        for target, columns in chunk.items():
+            for column, values in columns.items():
+                articles[target][column].extend(values)
+
+    return articles
+
+def to_frame(columns):
+    """
+    Convert the columns of one target into a dataframe.
+    """
+    dat = pd.DataFrame(columns, columns = COLUMNS)
+    dat['submitted_on'] = np.array(columns['submitted_on'], dtype = 'datetime64[s]')
+    return dat
 
-                    created = d['versions'][0]['created']
-                    splitted = created.split(' ')
-                    weekday = splitted[0][:-1]
-                    day = int(splitted[1])
-                    month = months_dict[splitted[2]]
-                    year = splitted[3]
-                    time = splitted[4]
-                    datetime_string = f'{year}-{month}-{day:02} {time}'
+def target_name(target):
+    category, pick_year = target
+    return pick_year + '_' + category
 
-                    articles.append((d['id'], d['submitter'], weekday, np.datetime64(datetime_string), num_authors))
+def target_path(target, out_dir = '.'):
+    return os.path.join(out_dir, target_name(target) + '.csv')
+
+def save_frame(dat, target, out_dir = '.', formats = ('csv',)):
+    """
+    Save the articles of one target as csv and/or in the columnar storage (see storage.py)
+    """
+    if 'csv' in formats:
+        dat.to_csv(target_path(target, out_dir), index = False)
+    if 'parquet' in formats:
+        storage.write_metadata(dat, target_name(target), out_dir)
 
-    dat = pd.DataFrame(articles)
-    dat.columns = ['id', 'submitter', 'weekday', 'submitted_on', 'num_authors']
+def save_data(articles, out_dir = '.', formats = ('csv',)):
+    """
+    Save the articles of every (category, year) target into its own file.
+    """
+    for target, columns in articles.items():
+        save_frame(to_frame(columns), target, out_dir, formats)
 
-    dat.to_csv(pick_year + '_' + category + '.csv', index = False)
+def get_targets_and_save(targets, snapshot = SNAPSHOT, out_dir = '.', processes = 1, formats = ('csv',)):
+    """
+    Saves information about arxiv articles from all the given (category, year) targets,
+    reading the snapshot only once.
+    """
+    with instrument.Stage('extract', targets = len(targets), processes = processes) as stage:
+        articles = get_data(targets, snapshot, processes)
+        stage.rows = sum(len(columns['id']) for columns in articles.values())
+    with instrument.Stage('save', rows = stage.rows, formats = list(formats)):
+        save_data(articles, out_dir, formats)
+
+def get_data_and_save(category, pick_year, snapshot = SNAPSHOT, out_dir = '.', processes = 1, formats = ('csv',)):
+    """
+    Saves information about arxiv articles from the given category and year.
+    """
+    get_targets_and_save([(category, pick_year)], snapshot, out_dir, processes, formats)
+
+#####
+# Incremental refresh
+#####
+
+MANIFEST = 'manifest.json'
+
+def load_manifest(out_dir = '.'):
+    path = os.path.join(out_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {'targets': [], 'records': {}}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_manifest(manifest, out_dir = '.'):
+    # Write to a temporary file first, so that a crash never leaves a broken manifest
+    path = os.path.join(out_dir, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(path + '.tmp', path)
+
+def refresh_targets(targets, snapshot = SNAPSHOT, out_dir = '.', processes = 1, formats = ('csv',)):
+    """
+    Bring the csv files of the given (category, year) targets up to date with a new
+    snapshot. The manifest in `out_dir` keeps the number of versions of every record
+    extracted so far; only new records and records with a new version are decoded, and
+    the existing csv files are patched with them. Falls back to a full extraction when
+    there is no manifest or the targets changed. The csv files are always kept, as they
+    are the base of the patching.
+    """
+    targets = sorted(set(targets))
+    manifest = load_manifest(out_dir)
+    full = [list(target) for target in targets] != manifest['targets'] or \
+                not all(os.path.exists(target_path(target, out_dir)) for target in targets)
+    known = {} if full else manifest['records']
+
+    seen = {}
+    with instrument.Stage('extract', targets = len(targets), processes = processes, full = full) as stage:
+        articles = get_data(targets, snapshot, processes, known, seen)
+        stage.rows = len(seen) # Records decoded
+
+    formats = set(formats) | {'csv'}
+    with instrument.Stage('save', rows = stage.rows, formats = sorted(formats)):
+        if full:
+            save_data(articles, out_dir, formats)
+        else:
+            for target, columns in articles.items():
+                old = pd.read_csv(target_path(target, out_dir), dtype = {'id': str, 'submitter': str})
+                changed = old['id'].isin(seen)
+                if not len(columns['id']) and not changed.any():
+                    continue
+
+                # Decoded records replace their old rows. The snapshot is sorted by arXiv ID,
+                # so sorting by ID restores the order of a full extraction.
+                old = old[~changed]
+                dat = pd.concat([old, to_frame(columns)]) if len(columns['id']) else old
+                dat = dat.sort_values('id', kind = 'stable')
+                save_frame(dat, target, out_dir, formats)
+
+    manifest = {'targets': [list(target) for target in targets],
+                'records': {**known, **seen}}
+    save_manifest(manifest, out_dir)
 
 #####
 # Extract the data about papers
 #####
 
-get_data_and_save('hep-th', '2015')
-get_data_and_save('hep-th', '2016')
-get_data_and_save('hep-th', '2017')
-get_data_and_save('hep-th', '2018')
-get_data_and_save('hep-th', '2019')
-get_data_and_save('hep-th', '2020')
+CATEGORIES = ['hep-th']
+YEARS = ['2015', '2016', '2017', '2018', '2019', '2020']
+FORMATS = ['csv', 'parquet']
+
+if __name__ == '__main__':
+    refresh_targets([(category, year) for category in CATEGORIES for year in YEARS],
+                    processes = os.cpu_count(), formats = FORMATS)
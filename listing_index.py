@@ -0,0 +1,221 @@
+"""
+Persistent index of the positions of papers in the arXiv listings. For every mailing
+window (see mailing_calendar.py) it keeps the submissions of the window sorted by
+submission time, all windows stored back to back in flat arrays (window i holds the
+entries offsets[i]:offsets[i + 1]). Adding new days only re-sorts the windows they
+fall in, and queries over a range of dates only touch the windows in it.
+
+The position (rank) of a paper is its rank by submission time in its window, with ties
+getting the average rank rounded down (same as groupby(...).rank().astype(int)).
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import mailing_calendar
+
+LISTING_INDEX = 'data/listing_index_{category}.npz'
+FIRST_MINUTE = 60 # Seconds after the window opens
+
+def to_seconds(times):
+    """
+    Timezone-aware times as int64 seconds since the epoch
+    """
+    return mailing_calendar.utc_times(times).astype('datetime64[s]').astype(np.int64)
+
+def fingerprint(ids):
+    """
+    Hash of a set of IDs that does not depend on their order, so that the papers in the
+    index can be compared to the ones in the data without matching them one by one
+    """
+    return int(pd.util.hash_array(np.asarray(ids, dtype = object)).sum(dtype = np.uint64))
+
+def to_mailing(date):
+    """
+    Mailing ID (YYYYMMDD) of a date, e.g. '2020-01-31'
+    """
+    date = pd.Timestamp(date)
+    return 10000*date.year + 100*date.month + date.day
+
+class ListingIndex:
+    """
+    Submissions of every mailing window sorted by time. Per window: `mailings` (ID of the
+    mailing, increasing) and `opens` (when the window opened, seconds since the epoch).
+    Per submission: `ids` and `times` (seconds since the epoch).
+    """
+    def __init__(self, holidays = ()):
+        self.holidays = np.array(sorted(holidays), dtype = 'datetime64[D]')
+        self.calendar = mailing_calendar.signature(self.holidays)
+        self.mailings = np.zeros(0, dtype = np.int32)
+        self.opens = np.zeros(0, dtype = np.int64)
+        self.offsets = np.zeros(1, dtype = np.int64)
+        self.ids = np.zeros(0, dtype = str)
+        self.times = np.zeros(0, dtype = np.int64)
+        self.fingerprint = 0 # Of the ids
+
+    @classmethod
+    def load(cls, path, holidays = ()):
+        """
+        Read the index saved in `path`. Returns an empty index if there is none or if it
+        was built with a different calendar (deadlines, holidays, ...).
+        """
+        index = cls(holidays)
+        if os.path.exists(path):
+            with np.load(path) as saved:
+                if 'calendar' in saved.files and str(saved['calendar']) == index.calendar:
+                    for name in ('mailings', 'opens', 'offsets', 'ids', 'times'):
+                        setattr(index, name, saved[name])
+                    index.fingerprint = int(saved['fingerprint'])
+        return index
+
+    def save(self, path):
+        temporary = path + '.tmp.npz'
+        np.savez(temporary, calendar = self.calendar, mailings = self.mailings, opens = self.opens,
+                 offsets = self.offsets, ids = self.ids, times = self.times,
+                 fingerprint = np.uint64(self.fingerprint))
+        os.replace(temporary, path)
+
+    def __len__(self):
+        return len(self.times)
+
+    def add(self, ids, submitted_on):
+        """
+        Add the given papers, skipping the ones already in the index. Only the windows
+        from the earliest new paper on are rebuilt, so adding new days is cheap. Returns
+        the number of papers added.
+        """
+        ids = np.asarray(ids, dtype = str)
+        times = to_seconds(submitted_on)
+        if len(ids) == 0:
+            return 0
+
+        dates = pd.DatetimeIndex(submitted_on).tz_convert(mailing_calendar.EASTERN).tz_localize(None)
+        calendar = mailing_calendar.build_calendar(dates.min().date(), dates.max().date(), self.holidays)
+        window = mailing_calendar.assign_windows(submitted_on, calendar)
+        mailings = calendar['mailing'].to_numpy()[window]
+        opens = to_seconds(calendar['open'])[window]
+
+        # Existing entries in the windows that have to be rebuilt
+        first = np.searchsorted(self.mailings, mailings.min())
+        counts = np.diff(self.offsets[first:])
+        start = self.offsets[first]
+
+        # Skip papers that are already there (or given twice)
+        fresh = ~pd.Index(ids).isin(self.ids[start:]) & ~pd.Index(ids).duplicated()
+        if not fresh.any():
+            return 0
+
+        mailings = np.concatenate([np.repeat(self.mailings[first:], counts), mailings[fresh]])
+        opens = np.concatenate([np.repeat(self.opens[first:], counts), opens[fresh]])
+        all_ids = np.concatenate([self.ids[start:], ids[fresh]])
+        times = np.concatenate([self.times[start:], times[fresh]])
+        order = np.lexsort((all_ids, times, mailings))
+        mailings, opens, all_ids, times = mailings[order], opens[order], all_ids[order], times[order]
+
+        window_start = np.flatnonzero(np.r_[True, mailings[1:] != mailings[:-1]])
+        self.mailings = np.concatenate([self.mailings[:first], mailings[window_start]])
+        self.opens = np.concatenate([self.opens[:first], opens[window_start]])
+        self.offsets = np.concatenate([self.offsets[:first], start + window_start, [start + len(times)]])
+        self.ids = np.concatenate([self.ids[:start], all_ids])
+        self.times = np.concatenate([self.times[:start], times])
+        self.fingerprint = (self.fingerprint + fingerprint(ids[fresh])) % 2**64
+        return int(fresh.sum())
+
+    def update(self, ids, submitted_on):
+        """
+        Make the index hold exactly the given papers. Usually the data only got new days,
+        then only the papers from the last window on are added. Returns whether the index
+        changed.
+        """
+        ids = np.asarray(ids, dtype = str)
+        submitted_on = pd.Series(submitted_on)
+        newer = np.ones(len(ids), dtype = bool)
+        if len(self.opens):
+            newer = (submitted_on >= pd.Timestamp(self.opens[-1], unit = 's', tz = 'UTC')).to_numpy()
+        changed = self.add(ids[newer], submitted_on[newer]) > 0
+
+        # Papers of earlier windows were added or removed
+        if self.fingerprint != fingerprint(ids):
+            changed |= self.add(ids, submitted_on) > 0
+            changed |= self.retain(ids) > 0
+        return changed
+
+    def retain(self, ids):
+        """
+        Drop the papers that are not among the given ids (e.g. no longer in the data), so
+        that they do not take positions in the listings. Returns the number of papers
+        dropped.
+        """
+        keep = pd.Index(self.ids).isin(np.asarray(ids, dtype = str))
+        if keep.all():
+            return 0
+        counts = np.add.reduceat(keep.astype(np.int64), self.offsets[:-1]) # Windows are never empty
+        windows = counts > 0
+        self.mailings, self.opens = self.mailings[windows], self.opens[windows]
+        self.offsets = np.r_[0, np.cumsum(counts[windows])]
+        self.ids, self.times = self.ids[keep], self.times[keep]
+        self.fingerprint = fingerprint(self.ids)
+        return int((~keep).sum())
+
+    def keep_last(self, num_windows = 1):
+        """
+        Drop all but the last `num_windows` windows. When the papers are added in time
+        order, only the last window can still get new papers.
+        """
+        first = max(len(self.mailings) - num_windows, 0)
+        start = self.offsets[first]
+        self.mailings, self.opens = self.mailings[first:], self.opens[first:]
+        self.offsets = self.offsets[first:] - start
+        self.ids, self.times = self.ids[start:], self.times[start:]
+        self.fingerprint = fingerprint(self.ids)
+
+    def windows(self, start = None, end = None):
+        """
+        Positions (first, last + 1) of the windows announced between the dates `start`
+        and `end` (inclusive, None for no limit)
+        """
+        first = 0 if start is None else np.searchsorted(self.mailings, to_mailing(start), side = 'left')
+        last = len(self.mailings) if end is None else np.searchsorted(self.mailings, to_mailing(end), side = 'right')
+        return first, max(first, last)
+
+    def frame(self, start = None, end = None):
+        """
+        All the papers announced between the dates `start` and `end` with columns 'id',
+        'mailing', 'submitted_on' (UTC), 'rank' and 'first_minute' (submitted less than a
+        minute after the window opened)
+        """
+        first, last = self.windows(start, end)
+        begin, stop = self.offsets[first], self.offsets[last]
+        counts = np.diff(self.offsets[first:last + 1])
+        window = np.repeat(np.arange(first, last), counts)
+        times = self.times[begin:stop]
+
+        # Ties are runs of equal times in a window, they get the average position
+        position = np.arange(begin, stop) - self.offsets[window]
+        tie_start = np.flatnonzero(np.r_[len(times) > 0, (times[1:] != times[:-1]) | (window[1:] != window[:-1])])
+        tie_size = np.diff(np.r_[tie_start, len(times)])
+        tie = np.repeat(np.arange(len(tie_start)), tie_size)
+        rank = position[tie_start][tie] + (tie_size[tie] - 1)//2 + 1
+
+        return pd.DataFrame({
+            'id':           self.ids[begin:stop],
+            'mailing':      self.mailings[window],
+            'submitted_on': pd.to_datetime(times, unit = 's', utc = True),
+            'rank':         rank,
+            'first_minute': times - self.opens[window] < FIRST_MINUTE,
+        })
+
+    def top(self, k, start = None, end = None):
+        """
+        Papers with rank <= k in the windows announced between the dates `start` and `end`
+        """
+        listing = self.frame(start, end)
+        return listing[listing['rank'] <= k].reset_index(drop = True)
+
+    def first_minute(self, start = None, end = None):
+        """
+        Papers submitted in the first minute of the windows announced between the dates
+        `start` and `end`
+        """
+        listing = self.frame(start, end)
+        return listing[listing['first_minute']].reset_index(drop = True)
@@ -0,0 +1,102 @@
+"""
+Calendar of the arXiv mailings. Submissions are collected in windows between two
+consecutive deadlines (Monday to Friday, 2 pm Eastern since 2017 and 4 pm before). The
+papers of a window are announced in one mailing on the evening of its deadline, except
+for the Friday deadline, which is announced on Sunday. There is no deadline on a
+holiday, its window then runs until the next deadline.
+
+build_calendar precomputes all the windows in a range of dates and assign_windows finds
+the window of every paper with a single sorted search.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+import pytz
+
+EASTERN = pytz.timezone('US/Eastern')
+
+DEADLINE_HISTORY = [ # (in effect since, deadline hour Eastern), estimated from the
+                     # submission times in the data (the first-minute rush moved in 2017)
+                        ('1991-01-01', 16),
+                        ('2017-01-01', 14),
+                   ]
+DEADLINE_WEEKDAYS = [0, 1, 2, 3, 4]       # Monday to Friday
+ANNOUNCE_DELAY = [0, 0, 0, 0, 2, 0, 0]    # Days from the deadline to the announcement, by weekday
+HOLIDAYS_PATH = 'data/holidays.txt'
+RULES_VERSION = 1 # Change when build_calendar or assign_windows change the windows
+
+def load_holidays(path = HOLIDAYS_PATH):
+    """
+    Read the dates without a deadline, one per line in the format YYYY-MM-DD ('#' starts
+    a comment). No holidays if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        lines = [line.split('#')[0].strip() for line in f]
+    return [line for line in lines if line]
+
+def signature(holidays = ()):
+    """
+    Hash of everything the windows depend on: the deadlines, the announcement delays, the
+    holidays and the version of the rules. Data derived from the calendar (e.g. the
+    listing index) is stale when it changes.
+    """
+    content = json.dumps([RULES_VERSION, DEADLINE_HISTORY, DEADLINE_WEEKDAYS, ANNOUNCE_DELAY,
+                          sorted(str(np.datetime64(day, 'D')) for day in holidays)])
+    return hashlib.sha256(content.encode()).hexdigest()
+
+def deadline_hour(dates):
+    """
+    Deadline hour (Eastern) in effect on the given dates (datetime64[D])
+    """
+    since = np.array([since for since, _ in DEADLINE_HISTORY], dtype = 'datetime64[D]')
+    hours = np.array([hour for _, hour in DEADLINE_HISTORY], dtype = np.int8)
+    return hours[np.searchsorted(since, dates, side = 'right') - 1]
+
+def build_calendar(start, end, holidays = ()):
+    """
+    All the submission windows with deadline between the dates `start` and `end`
+    (inclusive), plus the one after, so that every paper submitted between them has a
+    window. Returns a dataframe with one row per window and columns
+    * 'open'      - previous deadline, when the window opened (Eastern)
+    * 'deadline'  - when the window closed (Eastern)
+    * 'announced' - date of the mailing with the papers of the window
+    * 'mailing'   - ID of the mailing, its date as the integer YYYYMMDD
+    """
+    days = np.arange(np.datetime64(start, 'D') - 7, np.datetime64(end, 'D') + 8)
+    weekday = (days.astype(np.int64) + 3) % 7 # 1970-01-01 was a Thursday
+    is_deadline = np.isin(weekday, DEADLINE_WEEKDAYS) & ~np.isin(days, np.array(holidays, dtype = 'datetime64[D]'))
+    days, weekday = days[is_deadline], weekday[is_deadline]
+
+    deadlines = pd.DatetimeIndex(days + deadline_hour(days).astype('timedelta64[h]')).tz_localize(EASTERN)
+    announced = days + np.array(ANNOUNCE_DELAY)[weekday].astype('timedelta64[D]')
+    dates = pd.DatetimeIndex(announced)
+
+    return pd.DataFrame({
+        'open':      deadlines[:-1],
+        'deadline':  deadlines[1:],
+        'announced': announced[1:],
+        'mailing':   np.asarray(10000*dates.year + 100*dates.month + dates.day, dtype = np.int32)[1:],
+    })
+
+def utc_times(times):
+    """
+    Timezone-aware times as naive UTC datetime64[ns], which NumPy can search
+    """
+    return pd.DatetimeIndex(times).tz_convert('UTC').tz_localize(None).to_numpy(dtype = 'datetime64[ns]')
+
+def assign_windows(submitted_on, calendar):
+    """
+    Position in the calendar of the window every submission time falls in. A paper
+    submitted exactly at a deadline goes to the next window.
+    """
+    deadlines = utc_times(calendar['deadline'])
+    times = utc_times(submitted_on)
+    positions = np.searchsorted(deadlines, times, side = 'right')
+    if len(times) and (times.min() < utc_times(calendar['open'][:1])[0] or positions.max() == len(calendar)):
+        raise ValueError('submission times outside of the calendar')
+    return positions
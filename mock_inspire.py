@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""
+Local stand-in for the INSPIRE literature API (https://inspirehep.net/api/literature),
+used to try out inspire_hep.py without hitting the real server. Answers queries of the
+form q=arxiv:ID (or several of them joined with ' or ') with the citation counts from a python dictionary or an existing
+_citation_counts.csv file.
+"""
+
+import json
+import random
+import sys
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+
+DEFAULT_SIZE = 10 # Page size of the real API
+MAX_SIZE = 1000 # Larger pages are cut to this size
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep-alive
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            fail = server.rng.random() < server.error_rate
+
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != '/api/literature':
+            return self.reply(404, {'message': 'not found'})
+        if fail:
+            return self.reply(429, {'message': 'too many requests'}, {'Retry-After': '0'})
+
+        params = urllib.parse.parse_qs(url.query)
+        fields = params.get('fields', ['citation_count'])[0].split(',')
+        size = min(int(params.get('size', [DEFAULT_SIZE])[0]), server.max_size)
+        hits = []
+        for term in params.get('q', [''])[0].split(' or '):
+            arxiv_number = term.strip()[len('arxiv:'):]
+            if arxiv_number in server.citation_counts:
+                metadata = {'citation_count': server.citation_counts[arxiv_number],
+                            'arxiv_eprints': [{'value': arxiv_number}]}
+                hits.append({'metadata': {field: metadata[field] for field in fields if field in metadata}})
+        self.reply(200, {'hits': {'hits': hits[:size], 'total': len(hits)}})
+
+    def reply(self, status, content, headers = {}):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(citation_counts, port = 0, error_rate = 0.0, seed = 0, max_size = MAX_SIZE):
+    """
+    Start the stand-in server in a background thread. `citation_counts` maps arxiv IDs to
+    citation counts, papers missing from it are not found. A fraction `error_rate` of
+    the requests fails with HTTP 429 and pages have at most `max_size` hits. Returns the server, its URL is
+    f'http://127.0.0.1:{server.server_port}'. Call server.shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    server.citation_counts = dict(citation_counts)
+    server.error_rate = error_rate
+    server.max_size = max_size
+    server.rng = random.Random(seed)
+    server.requests = 0
+    server.lock = threading.Lock()
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
+
+def load_citation_counts(path):
+    """
+    Read citation counts from a _citation_counts.csv file, skipping papers without them
+    """
+    dat = pd.read_csv(path, dtype = str, keep_default_na = False)
+    dat = dat[dat['citation_counts'] != 'None']
+    return dict(zip(dat['id'], dat['citation_counts'].astype(int)))
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('Usage: python mock_inspire.py CITATION_COUNTS_CSV PORT')
+        print('Usage: python mock_inspire.py data/2020_hep-th_citation_counts.csv 8000')
+        exit()
+
+    server = serve(load_citation_counts(sys.argv[1]), int(sys.argv[2]))
+    print(f'Serving on http://127.0.0.1:{server.server_port}')
+    threading.Event().wait()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+"""
+One entry point for the whole study. The work is split into stages over (year,
+category) partitions:
+
+    extract  (kaggle.py, all partitions in one pass over the snapshot) -> data/2020_hep-th.csv
+    fetch    (inspire_hep.py, per partition) -> data/2020_hep-th_citation_counts.csv
+    process  (storage.py, per partition)     -> data/2020_hep-th.parquet
+    plot     (analyze.py, only if all the partitions it reads are selected) -> img/*.png
+
+A stage runs only if it has never run, its outputs are missing, or the hash of its
+inputs (data files and the code of the scripts it uses) changed since it last ran. The
+hashes are kept in data/pipeline_state.json; files larger than HASH_LIMIT (e.g. the
+snapshot) are identified by their size and modification time instead. Stale partitions
+of the process stage run in parallel.
+
+Citation counts change over time even if the inputs do not, use --force fetch (the
+citation cache still decides what is refetched, see inspire_hep.py).
+"""
+
+import os
+import json
+import hashlib
+import argparse
+import multiprocessing as mp
+from instrument import Stage
+
+DATA_DIR = 'data' # Where all the scripts read and write the data
+STATE_PATH = 'data/pipeline_state.json'
+HASH_LIMIT = 2**28 # Larger files are identified by size and modification time
+STAGES = ['extract', 'fetch', 'process', 'plot']
+CODE = { # Scripts whose code every stage depends on
+            'extract': ['kaggle.py', 'storage.py'],
+            'fetch':   ['inspire_hep.py'],
+            'process': ['storage.py'],
+            'plot':    ['analyze.py', 'utils.py', 'storage.py', 'aggregate.py', 'bootstrap.py', 'grouping.py',
+                        'listing_index.py', 'mailing_calendar.py', 'baseline.py', 'submitters.py'],
+       }
+
+#####
+# Signatures of the inputs
+#####
+
+class State:
+    """
+    Signatures of the inputs of the stages that ran, and a cache of the file hashes
+    keyed by size and modification time, so that unchanged files are not hashed again
+    """
+    def __init__(self, path = STATE_PATH):
+        self.path = path
+        self.stages = {}
+        self.files = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            self.stages, self.files = saved['stages'], saved['files']
+
+    def save(self):
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({'stages': self.stages, 'files': self.files}, f, indent = 1, sort_keys = True)
+        os.replace(self.path + '.tmp', self.path)
+
+    def file_hash(self, path):
+        """
+        Hash of the content of the file (of its size and modification time if it is
+        large), None if it does not exist
+        """
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        if stat.st_size > HASH_LIMIT:
+            return f'size={stat.st_size},mtime={stat.st_mtime_ns}'
+        cached = self.files.get(path)
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                digest.update(block)
+        self.files[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def signature(self, stage, inputs, params = None):
+        """
+        Hash of everything the stage depends on
+        """
+        here = os.path.dirname(os.path.abspath(__file__))
+        hashes = {path: self.file_hash(path) for path in inputs}
+        hashes.update({name: self.file_hash(os.path.join(here, name)) for name in CODE[stage]})
+        content = json.dumps([hashes, params], sort_keys = True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+#####
+# The stages
+#####
+
+def partition_name(partition):
+    year, category = partition
+    return f'{year}_{category}'
+
+def run_extract(partitions, args):
+    import kaggle
+    kaggle.refresh_targets([(category, year) for year, category in partitions], args.snapshot,
+                           out_dir = DATA_DIR, processes = args.processes or os.cpu_count(),
+                           formats = ['csv'])
+
+def run_fetch(partition, args):
+    import pandas as pd
+    import inspire_hep
+    which = partition_name(partition)
+    arxiv_numbers = pd.read_csv(os.path.join(DATA_DIR, which + '.csv'), usecols = ['id'], dtype = str)['id'].values
+    fetcher = inspire_hep.Fetcher(args.url, workers = args.workers, rate = args.rate)
+    cache = inspire_hep.CitationCache(os.path.join(DATA_DIR, 'citations.sqlite'))
+    citation_counts = inspire_hep.get_citation_counts_cached(fetcher, cache, arxiv_numbers, args.batch_size,
+                                                             ttl = args.ttl_days*24*3600)
+    cache.close()
+    inspire_hep.save_citation_counts(arxiv_numbers, citation_counts,
+                                     os.path.join(DATA_DIR, which + '_citation_counts.csv'))
+
+def run_process(partition):
+    import storage
+    with Stage('pipeline.process', partition = partition_name(partition)) as stage:
+        stage.rows = storage.import_csv(partition_name(partition), DATA_DIR)
+    return partition
+
+def run_plot(args):
+    import analyze
+    with Stage('pipeline.plot') as stage:
+        data = analyze.load_data()
+        stage.rows = sum(data['counts'])
+        analyze.render(data, processes = args.processes)
+        analyze.print_statistics(data)
+
+#####
+# Running the stale stages
+#####
+
+def csv_path(partition):
+    return os.path.join(DATA_DIR, partition_name(partition) + '.csv')
+
+def citations_path(partition):
+    return os.path.join(DATA_DIR, partition_name(partition) + '_citation_counts.csv')
+
+def parquet_path(partition):
+    return os.path.join(DATA_DIR, partition_name(partition) + '.parquet')
+
+def run(partitions, args):
+    """
+    Bring the outputs of all the stages up to date, running only the stale ones
+    """
+    state = State()
+    partitions = sorted(set(partitions))
+
+    def stale(key, stage, inputs, outputs, params = None):
+        signature = state.signature(stage, inputs, params)
+        fresh = (stage not in args.force and state.stages.get(key) == signature
+                 and all(os.path.exists(path) for path in outputs))
+        print(f'{key:<24} {"up to date" if fresh else "stale"}')
+        return None if fresh else signature
+
+    def done(key, stage, inputs, params = None):
+        state.stages[key] = state.signature(stage, inputs, params)
+        state.save()
+
+    # Extract: one pass over the snapshot for all the partitions
+    extract_inputs = [args.snapshot]
+    params = [list(partition) for partition in partitions]
+    if stale('extract', 'extract', extract_inputs, [csv_path(p) for p in partitions], params):
+        if not args.dry_run:
+            with Stage('pipeline.extract', partitions = len(partitions)):
+                run_extract(partitions, args)
+            done('extract', 'extract', extract_inputs, params)
+
+    # Fetch: one partition at a time, the rate limit of the API is shared anyway
+    for partition in partitions:
+        key, inputs = f'fetch/{partition_name(partition)}', [csv_path(partition)]
+        if stale(key, 'fetch', inputs, [citations_path(partition)]) and not args.dry_run:
+            with Stage('pipeline.fetch', partition = partition_name(partition)):
+                run_fetch(partition, args)
+            done(key, 'fetch', inputs)
+
+    # Process: stale partitions in parallel
+    jobs = []
+    for partition in partitions:
+        key = f'process/{partition_name(partition)}'
+        inputs = [csv_path(partition), citations_path(partition)]
+        if stale(key, 'process', inputs, [parquet_path(partition)]):
+            jobs.append((key, inputs, partition))
+    if jobs and not args.dry_run:
+        context = mp.get_context('fork') if 'fork' in mp.get_all_start_methods() else mp.get_context()
+        with context.Pool(min(args.processes or mp.cpu_count(), len(jobs))) as pool:
+            finished = set(pool.imap_unordered(run_process, [partition for _, _, partition in jobs]))
+        for key, inputs, partition in jobs:
+            if partition in finished:
+                done(key, 'process', inputs)
+
+    # Plot: everything analyze.py reads. It always plots its own category and years, so
+    # the stage only runs when all of them are selected.
+    import analyze
+    plotted = [(str(year), analyze.CATEGORY) for year in analyze.YEARS]
+    if not set(plotted) <= set(partitions):
+        print(f'{"plot":<24} skipped, analyze.py plots {analyze.CATEGORY} {analyze.YEARS[0]}-{analyze.YEARS[-1]}, '
+              'select all of these partitions to plot')
+        return
+    inputs = [parquet_path(partition) for partition in plotted]
+    inputs.append(os.path.join(DATA_DIR, 'holidays.txt'))
+    outputs = ['img/arxiv_' + name + '.png' for name in analyze.FIGURES]
+    if stale('plot', 'plot', inputs, outputs) and not args.dry_run:
+        run_plot(args)
+        done('plot', 'plot', inputs)
+
+if __name__ == '__main__':
+    import kaggle, inspire_hep
+    parser = argparse.ArgumentParser(description = 'Rebuild the stale data files and figures')
+    parser.add_argument('--years', default = ','.join(kaggle.YEARS), help = 'comma separated years')
+    parser.add_argument('--categories', default = ','.join(kaggle.CATEGORIES), help = 'comma separated categories')
+    parser.add_argument('--snapshot', default = kaggle.SNAPSHOT, help = 'arXiv metadata snapshot from Kaggle')
+    parser.add_argument('--processes', type = int, default = None, help = 'number of processes, all cores by default')
+    parser.add_argument('--force', nargs = '*', default = [], choices = STAGES, metavar = 'STAGE',
+                        help = 'run these stages even if they are up to date: ' + ', '.join(STAGES))
+    parser.add_argument('--dry-run', action = 'store_true', help = 'only show which stages are stale')
+    parser.add_argument('--url', default = inspire_hep.BASE_URL, help = 'INSPIRE server, e.g. a local stand-in')
+    parser.add_argument('--workers', type = int, default = 4, help = 'number of concurrent connections')
+    parser.add_argument('--rate', type = float, default = 3, help = 'maximum number of requests per second')
+    parser.add_argument('--batch-size', type = int, default = 100, help = 'number of papers per request')
+    parser.add_argument('--ttl-days', type = float, default = 30, help = 'refetch cached counts older than this')
+    args = parser.parse_args()
+
+    run([(year, category) for category in args.categories.split(',') for year in args.years.split(',')], args)
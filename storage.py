@@ -0,0 +1,136 @@
+"""
+Columnar storage of the data. Every year and category (e.g. '2020_hep-th') is kept in a
+single Parquet file data/2020_hep-th.parquet, with the information about the papers from
+kaggle.py and the number of citations from inspire_hep.py already joined and typed. The
+csv files data/2020_hep-th.csv and data/2020_hep-th_citation_counts.csv can be exported
+from it.
+
+Parquet support in pandas needs pyarrow.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['id', 'submitter', 'weekday', 'submitted_on', 'num_authors', 'citation_counts']
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+def parquet_path(which, data_dir = 'data'):
+    return os.path.join(data_dir, which + '.parquet')
+
+def csv_paths(which, data_dir = 'data'):
+    return (os.path.join(data_dir, which + '.csv'),
+            os.path.join(data_dir, which + '_citation_counts.csv'))
+
+def to_typed(dat):
+    """
+    Convert the columns of a dataframe with the information about papers to their
+    storage types
+    """
+    typed = pd.DataFrame({
+        'id':           dat['id'].astype(str),
+        'submitter':    dat['submitter'].astype('string'),
+        'weekday':      pd.Categorical(dat['weekday'], categories = WEEKDAYS),
+        'submitted_on': pd.to_datetime(dat['submitted_on'], utc = True).dt.as_unit('s'),
+        'num_authors':  dat['num_authors'].astype(np.int16),
+    })
+    if 'citation_counts' in dat:
+        typed['citation_counts'] = pd.to_numeric(dat['citation_counts'], errors = 'coerce').astype('Int32')
+    else:
+        typed['citation_counts'] = pd.array([pd.NA]*len(dat), dtype = 'Int32')
+    return typed.reset_index(drop = True)
+
+def write_metadata(dat, which, data_dir = 'data'):
+    """
+    Store the information about papers (the output of kaggle.py). Citation counts
+    already stored for the papers are kept, taken from the citation csv file if the
+    Parquet file is older than it.
+    """
+    dat = to_typed(dat)
+    path = parquet_path(which, data_dir)
+    if has_parquet(which, data_dir):
+        old = pd.read_parquet(path, columns = ['id', 'citation_counts'])
+    elif os.path.exists(csv_paths(which, data_dir)[1]):
+        old = pd.read_csv(csv_paths(which, data_dir)[1], dtype = {'id': str})
+        old['citation_counts'] = pd.to_numeric(old['citation_counts'], errors = 'coerce').astype('Int32')
+    else:
+        old = None
+    if old is not None:
+        dat['citation_counts'] = dat['id'].map(old.set_index('id')['citation_counts']).astype('Int32')
+    dat.to_parquet(path, index = False)
+
+def write_citations(arxiv_numbers, citation_counts, which, data_dir = 'data'):
+    """
+    Store the citation counts of the given papers (the output of inspire_hep.py). If there
+    is no Parquet file yet, the information about papers is taken from the csv file.
+    """
+    path = parquet_path(which, data_dir)
+    if has_parquet(which, data_dir):
+        dat = pd.read_parquet(path)
+    else:
+        dat = to_typed(pd.read_csv(csv_paths(which, data_dir)[0], dtype = {'id': str}))
+    fetched = pd.Series(list(citation_counts), index = list(arxiv_numbers), dtype = 'Int32')
+    fetched = fetched[~fetched.index.duplicated()]
+    dat['citation_counts'] = dat['citation_counts'].where(~dat['id'].isin(fetched.index),
+                                                          dat['id'].map(fetched)).astype('Int32')
+    dat.to_parquet(path, index = False)
+
+def has_parquet(which, data_dir = 'data'):
+    """
+    Whether there is a Parquet file at least as new as the csv files. An older one (e.g.
+    after a run that wrote only the csv files) is ignored in favor of the csv files.
+    """
+    path = parquet_path(which, data_dir)
+    if not os.path.exists(path):
+        return False
+    modified = os.path.getmtime(path)
+    return all(os.path.getmtime(csv) <= modified for csv in csv_paths(which, data_dir) if os.path.exists(csv))
+
+def read_partition(which, columns = None, data_dir = 'data'):
+    """
+    Read the joined data of one year and category, optionally only the given columns.
+    Papers without citation info have citation count <NA>.
+    """
+    return pd.read_parquet(parquet_path(which, data_dir), columns = columns)
+
+def import_csv(which, data_dir = 'data'):
+    """
+    Join the two csv files produced by kaggle.py and inspire_hep.py into the Parquet file,
+    returns the number of papers
+    """
+    metadata_path, citation_path = csv_paths(which, data_dir)
+    dat = pd.read_csv(metadata_path, dtype = {'id': str})
+    citations = pd.read_csv(citation_path, dtype = {'id': str})
+    assert(all(dat['id'] == citations['id']))
+    dat['citation_counts'] = citations['citation_counts']
+    to_typed(dat).to_parquet(parquet_path(which, data_dir), index = False)
+    return len(dat)
+
+def export_csv(which, data_dir = 'data'):
+    """
+    Write the stored data into the two csv files produced by kaggle.py and inspire_hep.py
+    """
+    dat = read_partition(which, data_dir = data_dir)
+    metadata_path, citation_path = csv_paths(which, data_dir)
+
+    metadata = dat[COLUMNS[:-1]].copy()
+    metadata['submitted_on'] = metadata['submitted_on'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    metadata.to_csv(metadata_path, index = False)
+
+    citations = pd.DataFrame({'id': dat['id'],
+                              'citation_counts': dat['citation_counts'].astype(object).where(dat['citation_counts'].notna(), 'None')})
+    citations.to_csv(citation_path, index = False)
+    os.utime(parquet_path(which, data_dir)) # The csv files are a copy, not newer data
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) != 3 or sys.argv[1] not in ('import', 'export'):
+        print('Usage: python storage.py import|export YEAR_CATEGORY')
+        print('Usage: python storage.py import 2020_hep-th')
+        exit()
+
+    which = sys.argv[2]
+    if sys.argv[1] == 'import':
+        import_csv(which)
+    else:
+        export_csv(which)
@@ -0,0 +1,47 @@
+"""
+Checks of the concurrent fetching in inspire_hep.py against the local stand-in server
+(mock_inspire.py): batched requests must give the same citation counts as one request
+per paper.
+"""
+
+import pytest
+import inspire_hep
+import mock_inspire
+
+CITATION_COUNTS = {f'2001.{number:05}': number % 37 for number in range(250)}
+CITATION_COUNTS.update({'hep-th/9901001': 1234, 'hep-th/0512345': 0})
+NOT_FOUND = ['2001.99998', '2001.99999', 'hep-th/9901002']
+ARXIV_NUMBERS = sorted(CITATION_COUNTS) + NOT_FOUND
+EXPECTED = [CITATION_COUNTS.get(arxiv_number) for arxiv_number in ARXIV_NUMBERS]
+
+@pytest.fixture
+def server():
+    server = mock_inspire.serve(CITATION_COUNTS, error_rate = 0.2, seed = 1)
+    yield server
+    server.shutdown()
+
+def fetcher(server):
+    # Failed requests are retried right away (the stand-in sends Retry-After: 0)
+    return inspire_hep.Fetcher(f'http://127.0.0.1:{server.server_port}', workers = 4, rate = 0,
+                               retries = 20, backoff = 0)
+
+def test_batched_matches_single(server):
+    single = list(fetcher(server).get_citation_counts(ARXIV_NUMBERS, 1))
+    batched = list(fetcher(server).get_citation_counts(ARXIV_NUMBERS, 100))
+    assert single == EXPECTED
+    assert batched == single
+
+def test_truncated_pages():
+    # Pages smaller than the batches, the papers that do not fit are fetched one by one
+    server = mock_inspire.serve(CITATION_COUNTS, error_rate = 0.2, seed = 2, max_size = 30)
+    try:
+        single = list(fetcher(server).get_citation_counts(ARXIV_NUMBERS, 1))
+        requests = server.requests
+        batched = list(fetcher(server).get_citation_counts(ARXIV_NUMBERS, 100))
+        assert server.requests - requests > len(ARXIV_NUMBERS) - 3*30 # Fallback was used
+    finally:
+        server.shutdown()
+    assert batched == single == EXPECTED
+
+def test_not_found():
+    assert inspire_hep.parse_citation_count({'hits': {'hits': [], 'total': 0}}) is None
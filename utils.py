@@ -1,29 +1,50 @@
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from datetime import datetime
-import pytz
-from scipy.optimize import curve_fit
-from matplotlib.transforms import Bbox
-
-DEADLINE = 14    # Deadline is 2 pm Eastern
-EASTERN = pytz.timezone('US/Eastern')
-ANNOUNCE_DAY = { # When is the paper announced if submitted before/after the deadline?
-                 # Submitted: Announced
-                    'Mon': ['Mon', 'Tue'],
-                    'Tue': ['Tue', 'Wed'],
-                    'Wed': ['Wed', 'Thu'],
-                    'Thu': ['Thu', 'Sun'],
-                    'Fri': ['Sun', 'Mon'],
-                    'Sat': ['Mon', 'Mon'],
-                    'Sun': ['Mon', 'Mon']
-                }
+import storage
+import mailing_calendar
+
+DEADLINE = 14    # Deadline is 2 pm Eastern (4 pm before 2017, see mailing_calendar.py)
+EASTERN = mailing_calendar.EASTERN
+WEEKDAYS = storage.WEEKDAYS
+MINUTE_BINS = ['00', '10', '20', '30', '40', '50']
+TIMES = [f'{hour}:{minute_bin}' for hour in range(24) for minute_bin in MINUTE_BINS]
+
+# Stored columns the features are computed from
+FEATURE_COLUMNS = ['weekday', 'submitted_on', 'citation_counts']
 
 #####
 # Data munging
 #####
 
-def load_and_process_data(which):
+def load_raw_data(which, columns = None):
+    """
+    Read the stored data of `which` (e.g. '2020_hep-th') without adding any features,
+    optionally only the given stored columns. Drops papers without citation info and
+    converts citation counts to int.
+
+    Reads the joined Parquet file data/<which>.parquet if there is one at least as new as
+    the csv files (see storage.py), otherwise the two csv files.
+    """
+    if storage.has_parquet(which):
+        dat = storage.read_partition(which, columns)
+    else:
+        metadata_path, citation_path = storage.csv_paths(which)
+        usecols = None if columns is None else ['id'] + [c for c in columns if c not in ('id', 'citation_counts')]
+        dat = pd.read_csv(metadata_path, usecols = usecols, dtype = {'id': str})
+        citation_counts = pd.read_csv(citation_path, dtype = {'id': str})
+
+        assert(len(dat) == len(citation_counts))
+        assert(all(dat['id'] == citation_counts['id']))
+
+        # Papers that were not found have citation count 'None'
+        dat['citation_counts'] = pd.to_numeric(citation_counts['citation_counts'], errors = 'coerce')
+
+    dat = dat[dat['citation_counts'].notna()].copy()
+
+    dat['citation_counts'] = dat['citation_counts'].astype(int)
+    return dat
+
+def load_and_process_data(which, columns = None, holidays = None):
     """
     Combine data from Kaggle with number of citations, process and add new features.
     
@@ -31,65 +52,76 @@ def load_and_process_data(which):
     citation boost as ratio of the number of citations and the average number of
     citations. Converts the submission datetime to Eastern timezone. Add columns:
     * 'hour'/'minute'/'second' - sumission time
-    * 'after_deadline' - is submitted after 2 pm?
+    * 'after_deadline' - is submitted after the deadline hour (2 pm, 4 pm before 2017)?
     * 'announced_on' - which day of the week was paper announced?
     * 'minute_bin' - submission minute rounded down, one of '00', '10', '20', ... '50'
     * 'time' - submission time, rounded down to ten minutes, in the format HH:MM
     * 'previous_deadline' - on which day did the submission round open?
+    * 'mailing' - ID of the mailing the paper was announced in (see mailing_calendar.py)
+
+    The papers are assigned to the submission windows of the mailing calendar, with no
+    deadline on the `holidays` (by default read from data/holidays.txt, if it exists).
+    The day names and times are stored as categoricals and the submission time
+    components as int8.
+
+    Reads the joined Parquet file data/<which>.parquet if there is one at least as new as
+    the csv files (see storage.py), otherwise the two csv files. With `columns`, only the listed stored columns (e.g.
+    ['id']) are loaded on top of the ones the features are computed from.
     
     Returns a pandas dataframe.
     """
-    dat = pd.read_csv('data/' + which + '.csv', parse_dates = ['submitted_on'], 
-                        date_parser=lambda x: pd.to_datetime(x, utc=True),)
-    citation_counts = pd.read_csv('data/' + which + '_citation_counts.csv')
+    if columns is not None:
+        columns = [c for c in storage.COLUMNS if c in columns or c in FEATURE_COLUMNS]
 
-    assert(all(dat['id'] == citation_counts['id']))
-    assert(len(dat) == len(citation_counts))
-
-    dat['citation_counts'] = citation_counts['citation_counts']
-
-    dat = dat[dat['citation_counts'] != 'None']
-
-    dat['citation_counts'] = dat['citation_counts'].astype(int)
+    dat = load_raw_data(which, columns)
 
     print(f"Average number of citations for {which} is {dat['citation_counts'].mean():.2f}")
 
     dat['citation_boost'] = 100*(dat['citation_counts']/dat['citation_counts'].mean() - 1)
 
-    dat['submitted_on'] = dat['submitted_on'].dt.tz_convert(EASTERN)
+    dat['submitted_on'] = pd.to_datetime(dat['submitted_on'], utc = True).dt.tz_convert(EASTERN)
 
-    dat['hour'] = dat['submitted_on'].dt.hour
-    dat['minute'] = dat['submitted_on'].dt.minute
-    dat['second'] = dat['submitted_on'].dt.second
+    dat['hour'] = dat['submitted_on'].dt.hour.astype(np.int8)
+    dat['minute'] = dat['submitted_on'].dt.minute.astype(np.int8)
+    dat['second'] = dat['submitted_on'].dt.second.astype(np.int8)
 
-    dat['after_deadline'] = dat['hour'] >= DEADLINE
+    submission_date = dat['submitted_on'].dt.tz_localize(None).dt.normalize().to_numpy(dtype = 'datetime64[D]')
+    dat['after_deadline'] = dat['hour'].to_numpy() >= mailing_calendar.deadline_hour(submission_date)
 
-    dat['announced_on'] = dat.apply(lambda x: ANNOUNCE_DAY[x.weekday][x.after_deadline], axis = 1)
+    dat['weekday'] = pd.Categorical(dat['weekday'], categories = WEEKDAYS)
 
-    dat['minute_bin'] = 10*(dat['minute'] // 10)
-    dat['minute_bin'] = dat['minute_bin'].astype(str)
-    dat.loc[dat['minute_bin'] == '0', 'minute_bin'] = '00'
+    minute_bin = dat['minute'].to_numpy() // 10
+    dat['minute_bin'] = pd.Categorical.from_codes(minute_bin, categories = MINUTE_BINS)
 
-    dat['time'] = dat['hour'].astype(str) + ':' + dat['minute_bin']
+    dat['time'] = pd.Categorical.from_codes(6*dat['hour'].to_numpy().astype(np.int16) + minute_bin,
+                                            categories = TIMES)
 
-    # On which date did the submissions open?
-    dat['previous_deadline'] = dat['submitted_on'].dt.date
-    dat.loc[dat['after_deadline'] == 0, 'previous_deadline'] -= pd.Timedelta(1, unit='D')
-    dat.loc[(dat['after_deadline'] == 1) & (dat['weekday'] == 'Sat'), 'previous_deadline'] -= pd.Timedelta(1, unit='D')
-    dat.loc[(dat['after_deadline'] == 0) & (dat['weekday'] == 'Sun'), 'previous_deadline'] -= pd.Timedelta(1, unit='D')
-    dat.loc[(dat['after_deadline'] == 1) & (dat['weekday'] == 'Sun'), 'previous_deadline'] -= pd.Timedelta(2, unit='D')
-    dat.loc[(dat['after_deadline'] == 0) & (dat['weekday'] == 'Mon'), 'previous_deadline'] -= pd.Timedelta(2, unit='D')
+    # Find the submission window of every paper
+    if holidays is None:
+        holidays = mailing_calendar.load_holidays()
+    if len(dat):
+        calendar = mailing_calendar.build_calendar(submission_date.min(), submission_date.max(), holidays)
+    else:
+        calendar = mailing_calendar.build_calendar('2000-01-01', '2000-01-01', holidays)
+    window = mailing_calendar.assign_windows(dat['submitted_on'], calendar)
+
+    announced = calendar['announced'].to_numpy(dtype = 'datetime64[D]')[window]
+    dat['announced_on'] = pd.Categorical.from_codes((announced.astype(np.int64) + 3) % 7, categories = WEEKDAYS)
+    dat['previous_deadline'] = calendar['open'].dt.tz_localize(None).dt.normalize().to_numpy()[window]
+    dat['mailing'] = calendar['mailing'].to_numpy()[window]
 
     return dat
 
 #####
-# Routines related to styling and saving plots
+# Routines related to styling and saving plots. Matplotlib is imported only when they are
+# used, so that loading the data does not pay for it.
 #####
 
 def style_plot(axs):
     """
     Apply some styling to the plot to make them look nice
     """
+    import matplotlib.pyplot as plt
     axs[0].spines['right'].set_visible(False) # Hide the bounding box
     axs[0].spines['top'].set_visible(False)
     axs[0].spines['left'].set_visible(False)
@@ -104,26 +136,70 @@ def style_plot(axs):
                         wspace=0.4,
                         hspace=0.4)
 
-def full_extent(ax, pad=0.0):
+def percent_ticks(ax):
+    """
+    Label the y ticks as percentages, wherever matplotlib puts them for the data
+    """
+    from matplotlib.ticker import PercentFormatter
+    ax.yaxis.set_major_formatter(PercentFormatter(decimals = 0))
+
+def full_extent(ax, pad=0.0, draw=True):
     """Get the full extent of an axes, including axes labels, tick labels, and
     titles."""
     # For text objects, we need to draw the figure first, otherwise the extents
     # are undefined.
-    ax.figure.canvas.draw()
+    from matplotlib.transforms import Bbox
+    if draw:
+        ax.figure.canvas.draw()
     items = ax.get_xticklabels() + ax.get_yticklabels()
     items += [ax, ax.title, ax.xaxis.label, ax.yaxis.label]
     bbox = Bbox.union([item.get_window_extent() for item in items])
 
     return bbox.expanded(1.0 + pad, 1.0 + pad)
 
-def save_plots(f, axs, name):
+def save_crop(image, bbox, dpi, path, facecolor):
     """
-    Save both subplots combined, as well as separately
+    Save the part of the rendered RGBA image inside bbox (in inches, measured from the
+    bottom left corner). Parts of bbox outside of the image are filled with facecolor.
     """
-    plt.savefig(f'img/{name}.png', bbox_inches = 'tight')
+    import matplotlib.pyplot as plt
+    height, width, _ = image.shape
+    x0 = int(np.round(bbox.x0*dpi))
+    y0 = int(np.round(height - bbox.y1*dpi)) # Image rows go from the top
+    w = int(bbox.width*dpi)
+    h = int(bbox.height*dpi)
+
+    crop = np.empty((h, w, 4), dtype = np.uint8)
+    crop[:] = np.round(255*np.array(facecolor)).astype(np.uint8)
+    rows = slice(max(y0, 0), min(y0 + h, height))
+    cols = slice(max(x0, 0), min(x0 + w, width))
+    crop[rows.start - y0:rows.stop - y0, cols.start - x0:cols.stop - x0] = image[rows, cols]
 
-    extent = full_extent(axs[0]).transformed(f.dpi_scale_trans.inverted())
-    plt.savefig(f'img/{name}_A.png', bbox_inches=extent.expanded(1.1,1.1))
+    plt.imsave(path, crop, dpi = dpi)
 
-    extent = full_extent(axs[1]).transformed(f.dpi_scale_trans.inverted())
-    plt.savefig(f'img/{name}_B.png', bbox_inches=extent.expanded(1.1,1.1))
+def save_plots(f, axs, name):
+    """
+    Save both subplots combined, as well as separately. The figure is rendered only once
+    (over the area covering all three images, which can stick out of the figure) and all
+    three images are cut out of the same rendered buffer.
+    """
+    import io
+    import matplotlib
+    import matplotlib.pyplot as plt
+    from matplotlib.transforms import Bbox
+    f.canvas.draw()
+    renderer = f.canvas.get_renderer()
+    facecolor = matplotlib.colors.to_rgba(f.get_facecolor())
+
+    extents = [f.get_tightbbox(renderer).padded(plt.rcParams['savefig.pad_inches'])] # Same as bbox_inches = 'tight'
+    for ax in axs:
+        extents.append(full_extent(ax, draw = False).transformed(f.dpi_scale_trans.inverted()).expanded(1.1,1.1))
+    area = Bbox.union(extents)
+
+    buffer = io.BytesIO()
+    f.savefig(buffer, format = 'rgba', dpi = f.dpi, bbox_inches = area)
+    width = int(area.width*f.dpi) # As in the Agg renderer
+    image = np.frombuffer(buffer.getbuffer(), dtype = np.uint8).reshape(-1, width, 4)
+
+    for extent, suffix in zip(extents, ['', '_A', '_B']):
+        save_crop(image, extent.translated(-area.x0, -area.y0), f.dpi, f'img/{name}{suffix}.png', facecolor)